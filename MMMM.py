@@ -3,8 +3,18 @@ import argparse
 import random
 import copy
 import sys
-import numpy as np
-from functools import lru_cache
+import math
+import hashlib
+import os
+import pickle
+import time
+import operator
+import threading
+from array import array
+from bisect import bisect
+from itertools import accumulate
+from collections import OrderedDict, deque
+from types import SimpleNamespace
 
 MAX_ATTEMPTS = 10000
 
@@ -45,16 +55,925 @@ BOSSHEARTS = 11
 SHOPUPGRADES = 2 + 3
 RETRO_ARROWS = 3
 
+# Triforce hunt simulation
+TFH_TRIALS = 500
+TFH_BATCH = 100
+TFH_TOLERANCE = 0.25 # Standard error, in minutes, at which the mean and std estimates count as converged
+TFH_SEED = 0 # Master seed of the per-entry simulations of --tfh simulate
+
+def tfh_checks_per_minute(total:int, shuffled:bool, doors:bool) -> float:
+    """Estimate how many checks per minute a runner gets through for a given pool size"""
+    if total < 300:
+        cpm = 1.7
+        if shuffled:
+            cpm *= 0.8
+    elif total < 500:
+        cpm = 3.3
+    elif total < 1000:
+        cpm = 4
+    elif total < 1500:
+        cpm = 5.3
+    else:
+        cpm = 7.8
+
+    if doors:
+        cpm = cpm*0.9
+    return cpm
+
+def tfh_points(mean_checks:float, std_checks:float, cpm:float) -> tuple:
+    """Convert the mean and standard deviation of checks to the goal into length and variance points"""
+    mean_time = mean_checks/cpm
+    std_dev = std_checks/cpm
+    length = int((mean_time-100)/10)-2
+    variance = int((std_dev-3)*2)+1
+    return length, variance
+
+# numpy is only needed to simulate triforce hunts, so it is imported on first use to keep cold starts fast.
+# A seed_rngs() before that is remembered and applied to numpy's random state when it is imported.
+_numpy = None
+_numpy_seed = None
+
+def load_numpy():
+    global _numpy
+    if _numpy is None:
+        import numpy
+        _numpy = numpy
+        if _numpy_seed is not None:
+            numpy.random.seed(_numpy_seed)
+    return _numpy
+
+def simulate_tfh_checks(goal:int, pool:int, total:int, cpm:float, trials:int = TFH_TRIALS, batch:int = TFH_BATCH, tolerance:float = TFH_TOLERANCE, rng = None) -> tuple:
+    """Estimate the mean and std of the number of checks needed to find the goal-th triforce piece.
+
+    The goal-th piece is found after goal-1 other pieces and every junk item whose random sort key
+    is below the goal-th smallest piece key, which is Beta(goal, pool-goal+1) distributed. A batch of
+    trials is therefore one beta and one binomial draw. Batches stop once the standard error of the
+    mean time (which also bounds that of the std) is within the tolerance. The draws come from rng
+    (a numpy Generator) when given, otherwise from numpy's global random state.
+    """
+    np = load_numpy()
+    rng = rng if rng is not None else np.random
+    junk = total - pool
+    checks = np.empty(0, dtype=np.int64)
+    while len(checks) < trials:
+        size = min(batch, trials - len(checks))
+        found = rng.binomial(junk, rng.beta(goal, pool - goal + 1, size=size)) + goal - 1
+        checks = np.concatenate((checks, found))
+        if checks.std() / np.sqrt(len(checks)) / cpm <= tolerance:
+            break
+    return float(checks.mean()), float(checks.std())
+
+def simulate_tfh_checks_shuffle(goal:int, pool:int, total:int, trials:int = TFH_TRIALS) -> tuple:
+    """Reference implementation of simulate_tfh_checks that shuffles the whole item pool for every trial"""
+    np = load_numpy()
+    checks_per_run = [None]*trials
+
+    bag = ['pool']*pool + ['junk']*(total-pool)
+    for i in range(trials):
+        np.random.shuffle(bag)
+        accumulator = 0
+        for checks,item in enumerate(bag):
+            if item == 'pool':
+                accumulator += 1
+                if accumulator == goal:
+                    break
+        checks_per_run[i] = checks
+
+    return float(np.mean(checks_per_run)), float(np.std(checks_per_run))
+
+def tfh_checks_exact(goal:int, pool:int, total:int) -> tuple:
+    """Closed-form mean and std of the number of checks needed to find the goal-th triforce piece.
+
+    The junk items found before the goal-th piece are negative hypergeometric distributed.
+    """
+    junk = total - pool
+    mean_checks = goal - 1 + goal * junk / (pool + 1)
+    var_checks = goal * junk * (total + 1) * (pool - goal + 1) / ((pool + 1) ** 2 * (pool + 2))
+    return mean_checks, math.sqrt(var_checks)
+
+# Precomputed analytic TFH points, built by MMMM_tfh.py
+TFH_TABLE_FILE = 'MMMM_tfh_table.bin'
+TFH_TABLE_VERSION = 1
+_tfh_tables = {}
+
+def tfh_table_source(input_weights:dict) -> str:
+    """Hash everything the reachable TFH grid depends on, so a table built from other inputs is never used"""
+    source = {
+        'version': TFH_TABLE_VERSION,
+        'goals': sorted(input_weights.get('tfh_goal', {})),
+        'deltas': sorted(input_weights.get('tfh_extra_pool', {})),
+        'pool': [NONDUNGEON, DUNGEON, KEYDROPS, SHOPSANITY, TAKE_ANY, UNDERWORLD, POTTERY],
+    }
+    return hashlib.sha1(json.dumps(source, sort_keys=True).encode('utf-8')).hexdigest()
+
+def load_tfh_table(path:str, source:str):
+    """Load a TFH table, or None if it is missing or was built from other inputs. Tables are loaded once per process."""
+    key = (path, source)
+    if key not in _tfh_tables:
+        _tfh_tables[key] = None
+        try:
+            with open(path, 'rb') as f:
+                table = json.loads(f.readline())
+                if table['source'] == source:
+                    table['values'] = array('h')
+                    table['values'].frombytes(f.read())
+                    if sys.byteorder != 'little':
+                        table['values'].byteswap()
+                    _tfh_tables[key] = table
+        except FileNotFoundError:
+            pass
+    return _tfh_tables[key]
+
+def tfh_table_lookup(table:dict, goal:int, pool:int, total:int, shuffled:bool, doors:bool):
+    """Look up the (length, variance) points of a TFH, or None if it is outside the table"""
+    entry = table['totals'].get(str(total))
+    if entry is None:
+        return None
+    offset, goal_min, goal_count, modifiers = entry
+    if not goal_min <= goal < goal_min + goal_count:
+        return None
+    for delta_index, tf_pooldelta in enumerate(table['deltas']):
+        if int(goal * (1 + tf_pooldelta / 100) + 1) == pool:
+            break
+    else:
+        return None
+    modifier = int(doors) + (2 * int(shuffled) if modifiers == 4 else 0)
+    index = 2 * (offset + ((goal - goal_min) * len(table['deltas']) + delta_index) * modifiers + modifier)
+    return table['values'][index], table['values'][index + 1]
+
+class TFHCache:
+    """LRU cache of the (length, variance) points of a TFH per (mode, source, goal, pool, total, shuffled, doors).
+
+    One instance lives per process, so the points are shared by every attempt, batch roll and server request it runs.
+    Only these deterministic points are kept, the goal and pool draws of triforcehunt() are made fresh every time.
+    With --tfh simulate the estimate is seeded from its key too, so which entries are cached never changes a roll.
+    """
+    def __init__(self, maxsize:int = 65536):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key:tuple, compute, stats = None) -> tuple:
+        """The cached points of key, computing them with compute() on a miss. Hits and misses are also counted into stats if given."""
+        points = self.entries.get(key)
+        if stats is not None:
+            stats.count('tfh_cache_misses' if points is None else 'tfh_cache_hits')
+        if points is None:
+            self.misses += 1
+            points = self.entries[key] = tuple(compute())
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return points
+
+    def to_dict(self) -> dict:
+        return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+tfh_cache = TFHCache()
+
 def print_to_stdout(*a) -> None:
     print(*a, file=sys.stdout)
 
-def make_mystery(input_weights, default_settings, args):
-    def within_limits(score: dict) -> bool:
+def print_to_stderr(*a) -> None:
+    print(*a, file=sys.stderr)
+
+PRESETS = {
+    'friendly': {'min_length': -6, 'max_length': 2, 'min_execution': -5, 'max_execution': 3, 'min_familiarity': -5, 'max_familiarity': 8, 'min_variance': -2, 'max_variance': 8, 'min_items': 1, 'max_items': 5},
+    'notslow': {'min_length': -2, 'max_length': 5, 'min_execution': -2, 'max_execution': 4, 'min_familiarity': 2, 'max_familiarity': 15, 'min_variance': -5, 'max_variance': 5, 'min_items': 0, 'max_items': 3},
+    'complex': {'min_length': 3, 'max_length': 12, 'min_execution': 0, 'max_execution': 6, 'min_familiarity': 8, 'max_familiarity': 20, 'min_variance': -8, 'max_variance': 5, 'min_items': 0, 'max_items': 3},
+    'ordeal': {'min_length': 13, 'max_length': 25, 'min_execution': 4, 'max_execution': 11, 'min_familiarity': 16, 'max_familiarity': 30, 'min_variance': -8, 'max_variance': 5, 'min_items': 0, 'max_items': 2},
+    'chaos': {'min_length': -100, 'max_length': 100, 'min_execution': -100, 'max_execution': 100, 'min_familiarity': -100, 'max_familiarity': 100, 'min_variance': -100, 'max_variance': 100, 'min_items': 3, 'max_items': 8},
+    'volatility': {'min_length': -100, 'max_length': 100, 'min_execution': -100, 'max_execution': 100, 'min_familiarity': -100, 'max_familiarity': 100, 'min_variance': 10, 'max_variance': 100, 'min_items': 0, 'max_items': 8},
+    'custom': {'min_length': -100, 'max_length': 100, 'min_execution': -100, 'max_execution': 100, 'min_familiarity': -100, 'max_familiarity': 100, 'min_variance': 10, 'max_variance': 100, 'min_items': 0, 'max_items': 2}
+}
+
+
+ATTRIBUTES = ('length', 'execution', 'familiarity', 'variance')
+LENGTH, EXECUTION, FAMILIARITY, VARIANCE = range(len(ATTRIBUTES))
+
+def add_points(score:list, points:tuple) -> None:
+    """Add a points vector to a score vector in place"""
+    score[LENGTH] += points[LENGTH]
+    score[EXECUTION] += points[EXECUTION]
+    score[FAMILIARITY] += points[FAMILIARITY]
+    score[VARIANCE] += points[VARIANCE]
+
+class CompiledSetting:
+    """The options of one setting as parallel arrays: weights, cumulative weights and an (options x 4) points matrix"""
+    __slots__ = ('options', 'index', 'weights', 'cum_weights', 'points')
+
+    def __init__(self, setting_weights:dict):
+        self.options = tuple(setting_weights)
+        self.index = {option: i for i, option in enumerate(self.options)}
+        self.weights = tuple(option_weights['weight'] for option_weights in setting_weights.values())
+        self.cum_weights = tuple(accumulate(self.weights))
+        self.points = tuple(tuple(option_weights[attr] for attr in ATTRIBUTES) for option_weights in setting_weights.values())
+
+    def copy(self) -> 'CompiledSetting':
+        """A mutable copy whose cumulative weights are recomputed on the next roll"""
+        compiled = CompiledSetting.__new__(CompiledSetting)
+        compiled.options = list(self.options)
+        compiled.index = dict(self.index)
+        compiled.weights = list(self.weights)
+        compiled.cum_weights = self.cum_weights
+        compiled.points = list(self.points)
+        return compiled
+
+    def roll(self) -> int:
+        """Pick an option index, consuming the same single random() draw as random.choices"""
+        if self.cum_weights is None:
+            self.cum_weights = tuple(accumulate(self.weights))
+        total = self.cum_weights[-1]
+        if not total > 0:
+            raise ValueError('Total of weights must be greater than zero')
+        return bisect(self.cum_weights, random.random() * total, 0, len(self.cum_weights) - 1)
+
+def compile_weights(input_weights:dict) -> dict:
+    """Compile a weights file into one CompiledSetting per setting"""
+    return {setting_name: CompiledSetting(setting_weights) for setting_name, setting_weights in input_weights.items()}
+
+class WeightOverlay:
+    """Read-only compiled base weights plus copies of the few settings the rule chain changes during one attempt.
+
+    The base is never mutated, so starting a new attempt only has to drop the changed settings.
+    """
+    __slots__ = ('base', 'changed')
+
+    def __init__(self, base:dict):
+        self.base = base
+        self.changed = {}
+
+    def reset(self) -> None:
+        """Drop every change made since the last reset"""
+        self.changed.clear()
+
+    def get(self, setting_name:str) -> CompiledSetting:
+        return self.changed.get(setting_name) or self.base[setting_name]
+
+    def edit(self, setting_name:str) -> CompiledSetting:
+        """Copy a setting into the overlay on its first change"""
+        compiled = self.changed.get(setting_name)
+        if compiled is None:
+            compiled = self.changed[setting_name] = self.base[setting_name].copy()
+        return compiled
+
+    def options(self, setting_name:str):
+        return self.get(setting_name).options
+
+    def weight(self, setting_name:str, option:str):
+        compiled = self.get(setting_name)
+        return compiled.weights[compiled.index[option]]
+
+    def points(self, setting_name:str, option:str) -> tuple:
+        compiled = self.get(setting_name)
+        return compiled.points[compiled.index[option]]
+
+    def set_weight(self, setting_name:str, option:str, weight) -> None:
+        compiled = self.edit(setting_name)
+        compiled.weights[compiled.index[option]] = weight
+        compiled.cum_weights = None
+
+    def force(self, setting_name:str, choice) -> None:
+        """Weigh choice 1 and every other option 0"""
+        compiled = self.edit(setting_name)
+        compiled.weights = [1 if option == choice else 0 for option in compiled.options]
+        compiled.cum_weights = None
+
+    def set_points(self, setting_name:str, option:str, attr:int, value:int) -> None:
+        compiled = self.edit(setting_name)
+        index = compiled.index[option]
+        points = list(compiled.points[index])
+        points[attr] = value
+        compiled.points[index] = tuple(points)
+
+    def rename(self, setting_name:str, option:str, new_option:str) -> None:
+        """Rename an option and move it to the end, like popping and re-inserting a dict key"""
+        compiled = self.edit(setting_name)
+        index = compiled.index[option]
+        order = [i for i in range(len(compiled.options)) if i != index] + [index]
+        compiled.options = [compiled.options[i] for i in order]
+        compiled.options[-1] = new_option
+        compiled.index = {option: i for i, option in enumerate(compiled.options)}
+        compiled.weights = [compiled.weights[i] for i in order]
+        compiled.cum_weights = None
+        compiled.points = [compiled.points[i] for i in order]
+
+# The order roll_mystery rolls settings in, and the ones only rolled on some branches of the rule chain
+ROLL_ORDER = (
+    'logic', 'goal', 'crystals_ganon', 'mode', 'dropshuffle', 'timer', 'shuffleenemies', 'shuffle', 'crystals_gt',
+    'door_shuffle', 'intensity', 'door_type_mode', 'decoupledoors', 'trap_door_mode', 'pottery', 'wild_dungeon_items',
+    'universal_small_keys', 'bow_mode', 'difficulty', 'bombbag', 'shopsanity', 'mystery', 'collection_rate', 'beemizer',
+    'key_logic_algorithm', 'any_enemy_logic', 'flute_mode', 'swords', 'shufflebosses', 'enemy_damage', 'enemy_health',
+    'boots_hint', 'restrict_boss_items', 'overworld_map', 'shufflelinks', 'shuffletavern', 'shuffleganon', 'openpyramid',
+    'experimental', 'algorithm', 'dungeon_counters', 'hints', 'pseudoboots', 'item_functionality', 'progressive',
+    'accessibility', 'take_any',
+)
+# The rolls after the last rule, which nothing reads until the TFH simulation and the start inventory
+TAIL_ROLLS = ROLL_ORDER[ROLL_ORDER.index('beemizer'):]
+ROLL_COLUMNS = {setting_name: column for column, setting_name in enumerate(ROLL_ORDER)}
+CONDITIONAL_ROLLS = ('crystals_ganon', 'crystals_gt', 'intensity', 'door_type_mode', 'decoupledoors', 'trap_door_mode', 'universal_small_keys')
+
+def rule_chain(chain) -> None:
+    """The rules between the rolls of a mystery, shared by roll_mystery and the BatchEngine.
+
+    A chain applies each step to the attempts selected by its last argument: a bool in roll_mystery, which runs one
+    attempt, and a row mask in the BatchEngine. Rolls without one apply to every attempt. chain.value() and
+    chain.other() select the attempts whose setting has or has not one of some values (the base setting where it
+    was not rolled), chain.letters() the ones whose setting contains every letter given. chain.negate() inverts a
+    selection, & and | combine them and chain.some() tells if a selection holds any attempt. Start items, renamed
+    items and the settings the chain assigns or picks without rolling add no points, the BatchEngine only keeps
+    the assignments later conditions read.
+    """
+    value, other, letters, negate, some, every = chain.value, chain.other, chain.letters, chain.negate, chain.some, chain.every
+    roll, force, weight, assign = chain.roll, chain.force, chain.weight, chain.assign
+
+    weight('algorithm', 'vanilla_fill', 0, every)
+
+    roll('logic')
+    rows = other('logic', 'noglitches')
+    if some(rows):
+        force('pseudoboots', 'off', rows)
+        chain.start_item('Pegasus Boots', rows)
+    force('door_shuffle', 'vanilla', value('logic', 'hybridglitches'))
+
+    roll('goal')
+    weight('algorithm', 'major_only', 0, value('goal', 'triforcehunt', 'ganonhunt', 'trinity'))
+    ganonhunt = value('goal', 'ganonhunt')
+    if some(ganonhunt):
+        force('openpyramid', 'on', ganonhunt)
+        force('shuffle', 'vanilla', ganonhunt)
+    rows = value('goal', 'completionist')
+    if some(rows):
+        force('accessibility', 'locations', rows)
+        force('mystery', 'off', rows)
+        force('timer', 'none', rows)
+        force('shopsanity', 'off', rows)
+    roll('crystals_ganon', value('goal', 'ganon', 'crystals'))
+    force('openpyramid', 'on', value('goal', 'crystals'))
+
+    roll('mode')
+    rows = value('mode', 'standard')
+    if some(rows):
+        weight('boots_hint', 'on', 1, rows)
+        weight('boots_hint', 'off', 1, rows)
+        weight('shuffle', 'insanity', 0, rows)
+        force('flute_mode', 'normal', rows)
+
+    roll('dropshuffle')
+    rows = value('dropshuffle', 'underworld')
+    if some(rows):
+        force('swords', 'assured', rows)
+        chain.start_item('Blue Boomerang', rows)
+        force('timer', 'none', rows)
+    rows = other('dropshuffle', 'none')
+    if some(rows):
+        weight('pottery', 'none', 0, rows)
+        weight('pottery', 'cave', 0, rows)
+
+    roll('timer')
+    rows = other('timer', 'none')
+    if some(rows):
+        force('shuffleenemies', 'none', rows)
+        force('shufflebosses', 'none', rows)
+        force('beemizer', '0', rows)
+        weight('pottery', 'dungeon', 0, rows)
+        weight('pottery', 'reduced', 0, rows)
+        weight('pottery', 'lottery', 0, rows)
+
+    roll('shuffleenemies')
+    rows = other('shuffleenemies', 'none')
+    if some(rows):
+        force('swords', 'assured', rows & value('mode', 'standard'))
+        weight('swords', 'swordless', 0, rows)
+        weight('enemy_health', 'hard', 0, rows)
+        weight('enemy_health', 'expert', 0, rows)
+
+    roll('shuffle')
+    vanilla = value('shuffle', 'vanilla')
+    if some(vanilla):
+        force('shuffleganon', 'off', vanilla)
+        force('shufflelinks', 'off', vanilla)
+        force('shuffletavern', 'off', vanilla)
+        force('overworld_map', 'default', vanilla)
+        force('take_any', 'none', vanilla)
+    rows = value('shuffle', 'lean')
+    if some(rows):
+        weight('pottery', 'lottery', 0, rows)
+        weight('pottery', 'reduced', 0, rows)
+        weight('pottery', 'cave', 0, rows)
+        weight('pottery', 'cavekeys', 0, rows)
+        force('shopsanity', 'off', rows)
+    rows = value('shuffle', 'insanity')
+    if some(rows):
+        force('bombbag', 'off', rows)
+        chain.start_item('Ocarina', rows)
+    rows = negate(vanilla)
+    if some(rows):
+        force('shuffleganon', 'off', rows & ganonhunt)
+        force('openpyramid', 'on', rows & ganonhunt)
+        force('shuffleganon', 'on', rows & negate(ganonhunt))
+        force('openpyramid', 'off', rows & negate(ganonhunt))
+        force('shufflelinks', 'on', rows & value('mode', 'inverted'))
+        weight('take_any', 'random', 0, rows)
+        weight('take_any', 'fixed', 0, rows)
+
+    # GT needs at most the crystals for ganon, and is only rolled for points on vanilla ganon
+    rows = vanilla & value('goal', 'ganon')
+    if some(rows):
+        chain.cap('crystals_gt', 'crystals_ganon', (LENGTH, EXECUTION), rows)
+        roll('crystals_gt', rows)
+    closed = vanilla & ganonhunt & value('openpyramid', 0)
+    assign('crystals_gt', '0', closed)
+    crystals = vanilla & value('goal', 'crystals')
+    chain.pick('crystals_gt', 'crystals_ganon', 7, crystals)
+    chain.pick('crystals_gt', None, 7, negate(rows | closed | crystals))
+
+    roll('door_shuffle')
+    rows = other('door_shuffle', 'vanilla')
+    if some(rows):
+        force('dungeon_counters', 'on', rows)
+        force('trap_door_mode', 'boss', rows)
+        force('accessibility', 'locations', rows)
+        roll('intensity', rows)
+        roll('door_type_mode', rows)
+        roll('decoupledoors', rows)
+        roll('trap_door_mode', rows)
+
+    roll('pottery')
+    pots = other('pottery', 'none', 'cave')
+    drops = other('dropshuffle', 'none')
+    force('dungeon_counters', 'on', pots | drops)
+    assign('dropshuffle', 'keys', pots & negate(drops))
+    assign('colorizepots', 1, other('pottery', 'none'))
+
+    rows = other('goal', 'triforcehunt', 'ganonhunt') & (other('pottery', 'none', 'cave', 'keys', 'cavekeys') | value('dropshuffle', 'underworld'))
+    if some(rows):
+        weight('wild_dungeon_items', 'none', 0, rows)
+        weight('wild_dungeon_items', 'b', 0, rows)
+        weight('wild_dungeon_items', 'mc', 0, rows)
+        weight('wild_dungeon_items', 'mcb', 0, rows)
+        weight('universal_small_keys', 'on', 0, rows)
+
+    roll('wild_dungeon_items')
+    rows = letters('wild_dungeon_items', 'mcsb')
+    force('restrict_boss_items', 'none', rows)
+    weight('restrict_boss_items', 'mapcompass', 0, negate(rows) & letters('wild_dungeon_items', 'mc'))
+    assign('mapshuffle', 1, letters('wild_dungeon_items', 'm'))
+    assign('compassshuffle', 1, letters('wild_dungeon_items', 'c'))
+    rows = letters('wild_dungeon_items', 's')
+    if some(rows):
+        roll('universal_small_keys', rows)
+        wild = value('universal_small_keys', 0)
+        assign('keyshuffle', 'wild', rows & wild)
+        assign('keyshuffle', 'universal', rows & negate(wild))
+        chain.drop('universal_small_keys', rows)
+    assign('bigkeyshuffle', 1, letters('wild_dungeon_items', 'b'))
+    chain.drop('wild_dungeon_items', every)
+
+    weight('startinventory', 'Small Key (Universal),Small Key (Universal),Small Key (Universal)', 0, other('keyshuffle', 'universal'))
+
+    roll('bow_mode')
+    rows = value('bow_mode', 'retro', 'retro_silvers')
+    if some(rows):
+        chain.rename('startinventory', 'Progressive Bow', 'Bow', rows)
+        weight('startinventory', 'Arrow Upgrade (+10)', 0, rows)
+
+    roll('difficulty')
+    weight('startinventory', 'Progressive Armor,Progressive Armor', 0, value('difficulty', 'hard', 'expert'))
+
+    roll('bombbag')
+    rows = value('bombbag', 1)
+    if some(rows):
+        weight('startinventory', 'Bomb Upgrade (+10)', 0, rows)
+        weight('startinventory', 'Bombs (10)', 0, rows)
+
+    roll('shopsanity')
+    roll('mystery')
+    force('collection_rate', 'off', value('shopsanity', 0) & value('pottery', 'none') & other('goal', 'completionist') & value('dropshuffle', 'none'))
+    roll('collection_rate')
+
+    force('beemizer', '0', other('pottery', 'none', 'keys') | value('dropshuffle', 'underworld') | other('timer', 'none'))
+    for setting_name in TAIL_ROLLS:
+        roll(setting_name)
+
+def attribute_limits(args) -> list:
+    """The (attribute, min, max) limits the score has to end inside"""
+    return [
+        (LENGTH, args.min_length, args.max_length),
+        (EXECUTION, args.min_execution, args.max_execution),
+        (FAMILIARITY, args.min_familiarity, args.max_familiarity),
+        (VARIANCE, args.min_variance, args.max_variance)
+    ]
+
+def limit_distance(score:list, args) -> int:
+    """How many points a score is outside the limits, summed over the attributes. 0 when it is within them."""
+    distance = 0
+    for attr, attr_min, attr_max in attribute_limits(args):
+        distance += max(0, attr_min - score[attr], score[attr] - attr_max)
+    if args.preset in ['chaos']:
+        if -2 <= score[LENGTH] <= 5:
+            distance += min(score[LENGTH] + 3, 6 - score[LENGTH])
+        if 8 >= score[FAMILIARITY]:
+            distance += 9 - score[FAMILIARITY]
+    return distance
+
+# Settings no later rule reads, which a near miss may re-roll on their own. Pseudoboots is the exception:
+# turning it on takes back Pegasus Boots handed out as a start item.
+REPAIRABLE = (
+    'beemizer', 'flute_mode', 'swords', 'shufflebosses', 'enemy_damage', 'enemy_health', 'boots_hint',
+    'restrict_boss_items', 'experimental', 'algorithm', 'dungeon_counters', 'hints', 'pseudoboots', 'item_functionality',
+)
+REPAIR_MARGIN = 2
+REPAIR_STEPS = 4
+
+class AttemptPruned(Exception):
+    """Raised to abandon an attempt whose score can no longer land inside the limits"""
+
+def points_range(setting:CompiledSetting, attr:int, optional:bool = False) -> tuple:
+    """Lowest and highest points any option of a setting adds, including options the rule chain may still force"""
+    values = [points[attr] for points in setting.points] + ([0] if optional else [])
+    return min(values), max(values)
+
+_pruning_bounds = OrderedDict()
+
+def pruning_bounds(compiled:dict, args) -> tuple:
+    """For each setting from the goal onwards, the score range after rolling it that can still end inside the limits.
+
+    Returns one table for goals without and one for goals with a triforce hunt, whose length and variance are
+    only known after the TFH simulation. Nothing is pruned before the goal is rolled. With --repair the ranges
+    are widened by REPAIR_MARGIN and the chaos length hole is dropped, so near misses still reach repair(). The
+    last few tables are kept, together with the compiled weights they were computed from.
+    """
+    key = (id(compiled), args.preset, args.repair, args.min_items, args.max_items, args.min_length, args.max_length, args.min_execution,
+           args.max_execution, args.min_familiarity, args.max_familiarity, args.min_variance, args.max_variance)
+    if key in _pruning_bounds:
+        return _pruning_bounds[key][1]
+    margin = REPAIR_MARGIN if args.repair else 0
+    items = max(args.min_items, args.max_items)
+    inventory = compiled['startinventory']
+    tfh_points = compiled.get('tfh_extra_pool')
+    limits = [(attr_min, attr_max) for _, attr_min, attr_max in attribute_limits(args)]
+    tables = ({}, {})
+    for tfh, table in enumerate(tables):
+        low = [0] * len(ATTRIBUTES)
+        high = [0] * len(ATTRIBUTES)
+        for attr in range(len(ATTRIBUTES)):
+            values = sorted(points[attr] for points in inventory.points)
+            low[attr] += sum(value for value in values[:items] if value < 0)
+            high[attr] += sum(value for value in values[::-1][:items] if value > 0)
+            if tfh and tfh_points:
+                tfh_low, tfh_high = points_range(tfh_points, attr)
+                low[attr] += tfh_low
+                high[attr] += tfh_high
+        for setting_name in reversed(ROLL_ORDER):
+            score_low = [attr_min - high[attr] - margin for attr, (attr_min, _) in enumerate(limits)]
+            score_high = [attr_max - low[attr] + margin for attr, (_, attr_max) in enumerate(limits)]
+            # Chaos needs a final length outside -2..5, which rules out the scores in between whose whole reachable range lies inside it
+            length_hole = None
+            if args.preset in ['chaos']:
+                score_low[FAMILIARITY] = max(score_low[FAMILIARITY], 9 - high[FAMILIARITY] - margin)
+                if not tfh and not args.repair and -2 - low[LENGTH] <= 5 - high[LENGTH]:
+                    length_hole = (-2 - low[LENGTH], 5 - high[LENGTH])
+            if tfh:
+                score_low[LENGTH] = score_low[VARIANCE] = -math.inf
+                score_high[LENGTH] = score_high[VARIANCE] = math.inf
+            table[setting_name] = (score_low, score_high, length_hole)
+            if setting_name == 'goal':
+                break
+            setting = compiled.get(setting_name)
+            if setting is None or not setting.options:
+                continue
+            for attr in range(len(ATTRIBUTES)):
+                setting_low, setting_high = points_range(setting, attr, setting_name in CONDITIONAL_ROLLS)
+                low[attr] += setting_low
+                high[attr] += setting_high
+    _pruning_bounds[key] = (compiled, tables)
+    if len(_pruning_bounds) > 32:
+        _pruning_bounds.popitem(last=False)
+    return tables
+
+# Start inventory solver
+_inventory_tables = OrderedDict()
+
+def inventory_table(groups:tuple, most:int) -> list:
+    """Count the start item subsets of at most most items by size and points total.
+
+    groups holds a (points, items) pair per distinct points vector of the candidate items. layers[g] maps
+    (size, points total) to the number of subsets of the first g groups, so a subset can be drawn backwards from any final entry.
+    """
+    key = (groups, most)
+    layers = _inventory_tables.get(key)
+    if layers is None:
+        layers = [{(0, (0,) * len(ATTRIBUTES)): 1}]
+        for points, items in groups:
+            layer = {}
+            for (size, total), ways in layers[-1].items():
+                for taken in range(min(items, most - size) + 1):
+                    entry = (size + taken, tuple(attr_total + taken * attr_points for attr_total, attr_points in zip(total, points)))
+                    layer[entry] = layer.get(entry, 0) + math.comb(items, taken) * ways
+            layers.append(layer)
+        _inventory_tables[key] = layers
+        if len(_inventory_tables) > 256:
+            _inventory_tables.popitem(last=False)
+    else:
+        _inventory_tables.move_to_end(key)
+    return layers
+
+# Batched attempts: the rule chain up to the start inventory over a block of attempts as NumPy arrays.
+# Each variant first screens BATCH_PILOT attempts drawn from BATCH_PILOT_SEED. Where more than BATCH_SURVIVAL of them
+# survive, the screen costs more than the attempts it saves and roll_mystery runs plain attempts instead. Otherwise
+# batches start at about BATCH_SURVIVORS expected survivors and double up to BATCH_ATTEMPTS.
+BATCH_PILOT = 256
+BATCH_PILOT_SEED = 0
+BATCH_SURVIVAL = 0.25
+BATCH_SURVIVORS = 4
+BATCH_ATTEMPTS = 4096
+
+def rolled_value(setting_name:str, option:str):
+    """The value set_rolled() stores for an option, some on/off settings are stored as 1/0"""
+    if setting_name not in ['progressive', 'dungeon_counters', 'openpyramid', 'dropshuffle'] and option in ('on', 'off'):
+        return 1 if option == 'on' else 0
+    return option
+
+class BatchEngine:
+    """Roll the rule chain from logic to take_any for a whole batch of attempts at once.
+
+    Each attempt draws one row of random numbers with a column per setting of ROLL_ORDER, so it rolls the same
+    whatever the size of the batch it is screened in. A single searchsorted() over the cumulative weights of every
+    setting, each normalized and shifted by its column, rolls all settings from their base weights up front.
+    rule_chain() keeps those rolls, re-rolls the settings whose weights it changes from an (attempts x options)
+    array it masks row by row like roll_mystery, and marks the settings it does not roll with -1. The scores then
+    add up attribute by attribute from the points of every option. An attempt survives the screen when its score is
+    still within the pruning bounds after take_any, i.e. the TFH and start inventory points can bring it inside the
+    limits (or within REPAIR_MARGIN of them with --repair). roll_mystery replays the survivors from their option
+    indices and finishes them with the TFH simulation and the start inventory, so accepted settings are distributed
+    as without the screen. It rejects an index its own weights rule out.
+    """
+    def __init__(self, compiled:dict, default_settings:dict, args):
+        np = load_numpy()
+        self.compiled = compiled
+        self.default_settings = default_settings
+        self.weights = {}
+        self.values = {}
+        self.unweighted = set()
+        self.letters = {}
+        starts = []
+        options = []
+        cum_weights = []
+        points = []
+        for column, setting_name in enumerate(ROLL_ORDER):
+            setting = compiled[setting_name]
+            starts.append(sum(options))
+            options.append(len(setting.options))
+            if not setting.options:
+                continue
+            self.weights[setting_name] = np.array(setting.weights, dtype=float)
+            self.values[setting_name] = [rolled_value(setting_name, option) for option in setting.options]
+            setting_cum_weights = np.cumsum(self.weights[setting_name])
+            if setting_cum_weights[-1] > 0:
+                cum_weights.append(column + setting_cum_weights / setting_cum_weights[-1])
+            else:
+                self.unweighted.add(setting_name)
+                cum_weights.append(np.full(len(setting.options), column + 1.0))
+            points.append(np.array(setting.points, dtype=np.int64).reshape(-1, len(ATTRIBUTES)))
+        self.cum_weights = np.concatenate(cum_weights)
+        self.columns = np.arange(len(ROLL_ORDER), dtype=float)
+        self.starts = np.array(starts)
+        self.last = np.array(options) - 1
+        # The points of every option per attribute, and a last zero for the settings an attempt does not roll
+        self.points = [np.append(attribute_points, 0) for attribute_points in np.concatenate(points).T]
+        tables = pruning_bounds(compiled, args)
+        self.low = np.array([tables[tfh]['take_any'][0] for tfh in (0, 1)], dtype=float)
+        self.high = np.array([tables[tfh]['take_any'][1] for tfh in (0, 1)], dtype=float)
+        self.length_hole = tables[0]['take_any'][2]
+        self.matches = {}
+        pilot = self.screen(BATCH_PILOT, np.random.default_rng(BATCH_PILOT_SEED))
+        self.survival = sum(head is not None for head in pilot) / BATCH_PILOT
+        self.first = min(math.ceil(BATCH_SURVIVORS / max(self.survival, 1 / BATCH_PILOT)), BATCH_ATTEMPTS)
+
+    def screen(self, size:int, rng=None) -> list:
+        """Roll size attempts from rng (numpy.random by default).
+
+        Returns the option index per setting of ROLL_ORDER of each survivor, -1 where it was not rolled, and None
+        for the others.
+        """
+        np = _numpy
+        compiled = self.compiled
+        draws = (np.random if rng is None else rng).random((size, len(ROLL_ORDER)))
+        base = np.minimum(np.searchsorted(self.cum_weights, draws + self.columns, side='right') - self.starts, self.last)
+        rolled = base.copy()
+        rolled[:, [ROLL_COLUMNS[setting_name] for setting_name in CONDITIONAL_ROLLS]] = -1
+        weights = {}
+        zeroed = {}
+        assigned = {}
+        every = np.ones(size, dtype=bool)
+
+        def edit(setting_name:str):
+            setting_weights = weights.get(setting_name)
+            if setting_weights is None:
+                setting_weights = weights[setting_name] = np.repeat(self.weights[setting_name][None, :], size, axis=0)
+            return setting_weights
+
+        def weight(setting_name:str, option:str, weight, rows) -> None:
+            if setting_name in self.weights and option in compiled[setting_name].index and np.count_nonzero(rows):
+                edit(setting_name)[rows, compiled[setting_name].index[option]] = weight
+
+        def force(setting_name:str, choice, rows) -> None:
+            if setting_name in self.weights and np.count_nonzero(rows):
+                setting_weights = edit(setting_name)
+                setting_weights[rows] = 0
+                if choice in compiled[setting_name].index:
+                    setting_weights[rows, compiled[setting_name].index[choice]] = 1
+
+        def cap(setting_name:str, by_setting:str, attrs:tuple, rows) -> None:
+            if setting_name in self.weights and np.count_nonzero(rows):
+                numbers = np.array([int(value) for value in self.values.get(by_setting, [])] + [int(self.default_settings.get(by_setting, 0))])
+                most = numbers[rolled[:, ROLL_COLUMNS[by_setting]]] if by_setting in self.values else np.full(size, numbers[-1])
+                options = np.array([int(option) for option in compiled[setting_name].options])
+                edit(setting_name)[rows] *= options[None, :] <= most[rows, None]
+                zeroed[setting_name] = (rows, list(attrs))
+
+        def roll(setting_name:str, rows=every) -> None:
+            if setting_name not in self.weights:
+                return
+            column = ROLL_COLUMNS[setting_name]
+            setting_weights = weights.get(setting_name)
+            if setting_weights is None:
+                if setting_name in self.unweighted and np.count_nonzero(rows):
+                    raise ValueError(f'Error rolling {setting_name} with weights {list(compiled[setting_name].weights)}')
+                if rows is every and setting_name not in CONDITIONAL_ROLLS:
+                    return
+                drawn = base[:, column]
+            else:
+                cum_weights = np.cumsum(setting_weights, axis=1)
+                totals = cum_weights[:, -1]
+                if not (totals[rows] > 0).all():
+                    raise ValueError(f'Error rolling {setting_name} with weights {setting_weights[rows & (totals <= 0)][0].tolist()}')
+                thresholds = draws[:, column] * totals
+                cum_weights[:, -1] = np.inf
+                drawn = (cum_weights > thresholds[:, None]).argmax(axis=1)
+            rolled[:, column] = drawn if rows is every else np.where(rows, drawn, -1)
+
+        def value(setting_name:str, *values):
+            matches = self.matches.get((setting_name, values))
+            if matches is None:
+                matches = self.matches[setting_name, values] = np.array([value in values for value in self.values.get(setting_name, [])]
+                                                                        + [self.default_settings.get(setting_name) in values])
+            rows = matches[rolled[:, ROLL_COLUMNS[setting_name]]] if setting_name in self.values else np.full(size, matches[-1])
+            for assigned_rows, assigned_value in assigned.get(setting_name, ()):
+                rows = np.where(assigned_rows, assigned_value in values, rows)
+            return rows
+
+        def other(setting_name:str, *values):
+            return ~value(setting_name, *values)
+
+        def letters(setting_name:str, letters:str):
+            values = self.letters.get((setting_name, letters))
+            if values is None:
+                values = self.letters[setting_name, letters] = tuple(option for option in self.values.get(setting_name, []) if all(letter in option for letter in letters))
+            return value(setting_name, *values)
+
+        def assign(setting_name:str, setting_value, rows) -> None:
+            assigned.setdefault(setting_name, []).append((rows, setting_value))
+
+        def ignore(*_) -> None:
+            pass
+
+        rule_chain(SimpleNamespace(every=every, value=value, other=other, letters=letters, negate=np.logical_not, some=np.count_nonzero, roll=roll,
+                                   force=force, weight=weight, cap=cap, assign=assign, pick=ignore, drop=ignore, start_item=ignore, rename=ignore))
+
+        indices = np.where(rolled >= 0, rolled + self.starts, len(self.points[0]) - 1)
+        score = np.stack([attribute_points[indices].sum(axis=1) for attribute_points in self.points], axis=1)
+        for setting_name, (rows, attrs) in zeroed.items():
+            for attr in attrs:
+                score[rows, attr] -= self.points[attr][indices[rows, ROLL_COLUMNS[setting_name]]]
+        tfh = value('goal', 'triforcehunt', 'ganonhunt').astype(np.int64)
+        survivors = ((score >= self.low[tfh]) & (score <= self.high[tfh])).all(axis=1)
+        if self.length_hole:
+            survivors &= (tfh == 1) | (score[:, LENGTH] < self.length_hole[0]) | (score[:, LENGTH] > self.length_hole[1])
+        heads = [None] * size
+        for row, head in zip(np.flatnonzero(survivors).tolist(), rolled[survivors].tolist()):
+            heads[row] = head
+        return heads
+
+class BatchHeads:
+    """Screened attempts waiting for roll_mystery, and the size of the next batch. Unseeded rolls can share one."""
+    __slots__ = ('heads', 'size')
+
+    def __init__(self):
+        self.heads = deque()
+        self.size = None
+
+    def next(self, engine:BatchEngine, most:int):
+        """The rolls of the next attempt, None if it was screened out, screening a new batch of at most most attempts when empty"""
+        if not self.heads:
+            size = self.size or engine.first
+            self.heads.extend(engine.screen(min(size, most)))
+            self.size = min(2 * size, BATCH_ATTEMPTS)
+        return self.heads.popleft()
+
+_batch_engines = OrderedDict()
+
+def batch_engine(compiled:dict, default_settings:dict, args) -> BatchEngine:
+    """The BatchEngine of compiled weights, default settings and limits, kept alive with them for the last few variants.
+
+    None where more than BATCH_SURVIVAL of the pilot attempts survive the screen.
+    """
+    key = (id(compiled), id(default_settings), args.preset, args.repair, args.min_items, args.max_items) + tuple(limit for _, *limits in attribute_limits(args) for limit in limits)
+    entry = _batch_engines.get(key)
+    if entry is None:
+        entry = _batch_engines[key] = (compiled, default_settings, BatchEngine(compiled, default_settings, args))
+        if len(_batch_engines) > 32:
+            _batch_engines.popitem(last=False)
+    else:
+        _batch_engines.move_to_end(key)
+    return entry[2] if entry[2].survival <= BATCH_SURVIVAL else None
+
+class RollStats:
+    """Opt-in instrumentation of roll_mystery: seconds per phase, event counters and a histogram of rejection reasons"""
+    __slots__ = ('phases', 'counters', 'rejections')
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = {}
+        self.rejections = {}
+
+    def add_time(self, phase:str, seconds:float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+    def count(self, counter:str, amount:int = 1) -> None:
+        self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def reject(self, reason:str) -> None:
+        self.rejections[reason] = self.rejections.get(reason, 0) + 1
+
+    def timed(self, func, phase:str):
+        """Wrap func so its calls and the seconds spent in it add up under phase"""
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add_time(phase, time.perf_counter() - start)
+                self.count(f'{phase}_calls')
+        return wrapper
+
+    def merge(self, stats:dict) -> None:
+        """Add the to_dict() output of another RollStats, e.g. from a worker process"""
+        for phase, seconds in stats['phases'].items():
+            self.add_time(phase, seconds)
+        for counter, amount in stats['counters'].items():
+            self.count(counter, amount)
+        for reason, amount in stats['rejections'].items():
+            self.rejections[reason] = self.rejections.get(reason, 0) + amount
+
+    def to_dict(self) -> dict:
+        return {
+            'phases': {phase: round(seconds, 6) for phase, seconds in self.phases.items()},
+            'counters': dict(self.counters),
+            'rejections': dict(sorted(self.rejections.items(), key=lambda item: -item[1])),
+        }
+
+def limit_violations(score:list, args) -> list:
+    """The bounds a score breaks, e.g. 'length>max', plus the chaos length hole and familiarity floor"""
+    violations = []
+    if args.preset in ['chaos']:
+        if -2 <= score[LENGTH] <= 5:
+            violations.append('chaos:length_hole')
+        if 8 >= score[FAMILIARITY]:
+            violations.append('chaos:familiarity')
+    for attr, attr_min, attr_max in attribute_limits(args):
+        if score[attr] < attr_min:
+            violations.append(f'{ATTRIBUTES[attr]}<min')
+        elif score[attr] > attr_max:
+            violations.append(f'{ATTRIBUTES[attr]}>max')
+    return violations
+
+def roll_mystery(input_weights:dict, default_settings:dict, args, compiled:dict = None, max_attempts:int = MAX_ATTEMPTS + 1, should_stop=None, stats:RollStats = None, deadline:float = None,
+                 batch_heads:BatchHeads = None) -> dict:
+    """Search for settings whose score fits the limits.
+
+    Returns the settings (None if no combination was found), the final score, the number of attempts and
+    whether the accepted attempt needed a --repair.
+    Pass the compile_weights() output of input_weights as compiled to skip compiling it again. The search
+    gives up after max_attempts, before any attempt where should_stop() returns True, or once time.monotonic()
+    passes deadline. If a RollStats is given, the time per phase, counters and rejection reasons are
+    collected into it and returned as 'stats'. With --best-effort a failed search also returns its
+    closest miss as 'closest', which use_closest() turns into the result.
+
+    With --engine batch the attempts are screened in batches by a BatchEngine and only the survivors run the rule
+    chain, unless too many attempts survive the screen for it to pay off. Unseeded rolls may pass the same
+    BatchHeads to use up each other's screened attempts.
+    """
+    def within_limits(score: list) -> bool:
         """Check if the score is within the limits of the input weights"""
         if args.preset in ['chaos']:
-            if -2 <= score['length'] <= 5:
+            if -2 <= score[LENGTH] <= 5:
                 return False
-            if 8 >= score['familiarity']:
+            if 8 >= score[FAMILIARITY]:
                 return False
         for attr,min,max in attrs:
             score_val = score[attr]
@@ -62,21 +981,36 @@ def make_mystery(input_weights, default_settings, args):
                 return False
         return True
    
-    def roll_setting(setting_name: str) -> None:
+    def roll_setting(setting_name: str, rows: bool = True) -> None:
         """Randomly select a setting based on its weights and update the score accordingly."""
-        options = list(input_weights[setting_name].keys())
-        weights = [input_weights[setting_name][option]['weight'] for option in options]
+        if not rows:
+            return
+        compiled = overlay.get(setting_name)
 
-        if not weights:
+        if not compiled.options:
             return
 
+        if head is not None and not repairing:
+            index = head[ROLL_COLUMNS[setting_name]]
+            if index < 0 or not compiled.weights[index] > 0:
+                raise ValueError(f'The batch engine rolled {setting_name} where the rule chain does not allow it')
+            set_rolled(setting_name, compiled, index)
+            return
         try:
-            choice = random.choices(options, weights=weights, k=1)[0]
+            index = compiled.roll()
         except:
-            raise ValueError(f'Error rolling {setting_name} with weights {weights}')
+            raise ValueError(f'Error rolling {setting_name} with weights {list(compiled.weights)}')
 
-        for attr,_,_ in attrs:
-            score[attr] += input_weights[setting_name][choice][attr]
+        set_rolled(setting_name, compiled, index)
+        # With --best-effort, attempts run to the end until one of them can serve as the closest miss
+        if args.prune and not repairing and setting_name in prune_bounds[0] and (closest is not None or not args.best_effort):
+            check_bounds(setting_name)
+
+    def set_rolled(setting_name: str, compiled: CompiledSetting, index: int) -> None:
+        """Store a rolled option in the settings and add its points to the score"""
+        add_points(score, compiled.points[index])
+        choice = compiled.options[index]
+        rolled[setting_name] = index
 
         # Some arbitrary settings need to be bools instead of ints
         if setting_name not in ['progressive', 'dungeon_counters', 'openpyramid', 'dropshuffle']:
@@ -87,13 +1021,61 @@ def make_mystery(input_weights, default_settings, args):
 
         settings[setting_name] = choice
 
-    def force_setting(setting_name: str, choice) -> None:
-        """Force a setting to a specific value"""
-        for key in input_weights[setting_name]:
-            if key == choice:
-                input_weights[setting_name][key]['weight'] = 1
-            else:
-                input_weights[setting_name][key]['weight'] = 0
+    def check_bounds(setting_name: str) -> None:
+        """Abandon the attempt once the remaining rolls, TFH points and start inventory can no longer bring the score inside the limits"""
+        low, high, length_hole = prune_bounds[settings['goal'] in ['triforcehunt', 'ganonhunt']][setting_name]
+        if not (low[LENGTH] <= score[LENGTH] <= high[LENGTH] and low[EXECUTION] <= score[EXECUTION] <= high[EXECUTION]
+                and low[FAMILIARITY] <= score[FAMILIARITY] <= high[FAMILIARITY] and low[VARIANCE] <= score[VARIANCE] <= high[VARIANCE]):
+            raise AttemptPruned(setting_name)
+        if length_hole and length_hole[0] <= score[LENGTH] <= length_hole[1]:
+            raise AttemptPruned(setting_name)
+
+    def pruned_reason(setting_name: str) -> str:
+        """The bound check_bounds() abandoned the attempt on, e.g. 'pruned:length>max'"""
+        low, high, length_hole = prune_bounds[settings['goal'] in ['triforcehunt', 'ganonhunt']][setting_name]
+        for attr in range(len(ATTRIBUTES)):
+            if score[attr] < low[attr]:
+                return f'pruned:{ATTRIBUTES[attr]}<min'
+            if score[attr] > high[attr]:
+                return f'pruned:{ATTRIBUTES[attr]}>max'
+        return 'pruned:chaos:length_hole'
+
+    def pushes_out(points:tuple) -> bool:
+        """Whether the points of a rolled option push the score in the direction it is out of bounds"""
+        if args.preset in ['chaos']:
+            if -2 <= score[LENGTH] <= 5 and points[LENGTH] != 0:
+                return True
+            if 8 >= score[FAMILIARITY] and points[FAMILIARITY] < 0:
+                return True
+        for attr, attr_min, attr_max in attrs:
+            if score[attr] < attr_min and points[attr] < 0:
+                return True
+            if score[attr] > attr_max and points[attr] > 0:
+                return True
+        return False
+
+    def repair() -> bool:
+        """Re-roll independent settings that push a near miss out of bounds until it fits, or give up after REPAIR_STEPS"""
+        nonlocal repairing
+        repairing = True
+        try:
+            for _ in range(REPAIR_STEPS):
+                candidates = [setting_name for setting_name in REPAIRABLE if setting_name in rolled
+                              and pushes_out(overlay.get(setting_name).points[rolled[setting_name]])]
+                if not candidates:
+                    return False
+                setting_name = random.choice(candidates)
+                add_points(score, tuple(-points for points in overlay.get(setting_name).points[rolled[setting_name]]))
+                roll_setting(setting_name)
+                if setting_name == 'pseudoboots' and settings['pseudoboots'] == 1 and 'Pegasus Boots' in startinventory:
+                    # Logic-given boots force pseudoboots off, so these were a start item
+                    add_points(score, tuple(-points for points in overlay.points('startinventory', 'Pegasus Boots')))
+                    startinventory.remove('Pegasus Boots')
+                if within_limits(score):
+                    return True
+            return False
+        finally:
+            repairing = False
 
     def determine_pool_size() -> int:
         """Determine the size of the item pool based on the settings"""
@@ -126,71 +1108,52 @@ def make_mystery(input_weights, default_settings, args):
         return mandatory_pool_size        
 
     def simulate_tfh(goal:int, pool:int, total:int) -> tuple:
-        """Simulate a triforce hunt run to estimate the average time to completion"""
-        if total < 300:
-            cpm = 1.7
-            if settings['shuffle'] != 'vanilla':
-                cpm *= 0.8
-        elif total < 500:
-            cpm = 3.3
-        elif total < 1000:
-            cpm = 4
-        elif total < 1500:
-            cpm = 5.3
-        else:
-            cpm = 7.8
-
-        if settings['door_shuffle'] != 'vanilla':
-            cpm = cpm*0.9
+        """Estimate the (length, variance) points of a triforce hunt run, cached per process in tfh_cache"""
+        shuffled = settings['shuffle'] != 'vanilla'
+        doors = settings['door_shuffle'] != 'vanilla'
+
+        def compute() -> tuple:
+            cpm = tfh_checks_per_minute(total, shuffled, doors)
+            if args.tfh == 'simulate':
+                # A private generator seeded from the entry leaves the roll's own random state alone
+                rng = load_numpy().random.default_rng(derive_seed(TFH_SEED, goal, pool, total, shuffled, doors))
+                mean_checks, std_checks = simulate_tfh_checks(goal, pool, total, cpm, rng=rng)
+                return tfh_points(mean_checks, std_checks, cpm)
+            table = load_tfh_table(TFH_TABLE_FILE, tfh_source)
+            points = tfh_table_lookup(table, goal, pool, total, shuffled, doors) if table else None
+            if points is None:
+                points = tfh_points(*tfh_checks_exact(goal, pool, total), cpm)
+            return points
+        return tfh_cache.get((args.tfh, tfh_source, goal, pool, total, shuffled, doors), compute, stats)
 
-        time_per_run = [None]*500
-
-        bag = ['pool']*pool + ['junk']*(total-pool)
-        for i in range(500):
-            np.random.shuffle(bag)
-            accumulator = 0
-            for checks,item in enumerate(bag):
-                if item == 'pool':
-                    accumulator += 1
-                    if accumulator == goal:
-                        break
-            time_per_run[i] = checks/cpm 
-        
-        mean_time = np.mean(time_per_run)
-        std_dev = np.std(time_per_run)
-        length = int((mean_time-100)/10)-2
-        variance = int((std_dev-3)*2)+1
-
-        return length, variance
-
-    @lru_cache(maxsize=None)  # maxsize=None means there's no limit to the cache size
     def triforcehunt(minimum_pool_size:int , current_pool_size:int) -> list:
         roll_weights = []
        
         pool_space = current_pool_size - minimum_pool_size
         base_fraction = current_pool_size / 216
         
-        tfh_goal_weights = input_weights.get('tfh_goal', {})
-        tfh_extra_pool_weights = input_weights.get('tfh_extra_pool', {})
+        tfh_goal_weights = overlay.base.get('tfh_goal')
+        tfh_extra_pool_weights = overlay.base.get('tfh_extra_pool')
+        tfh_goals = zip(tfh_goal_weights.options, tfh_goal_weights.weights) if tfh_goal_weights else ()
 
-        rolls = [int(tf_goalfraction) for tf_goalfraction, goalpoints in tfh_goal_weights.items() if random.random() < goalpoints['weight']]
+        rolls = [int(tf_goalfraction) for tf_goalfraction, goal_weight in tfh_goals if random.random() < goal_weight]
         for tf_goalfraction in rolls:
             tf_goal = int(tf_goalfraction * base_fraction * random.uniform(0.85, 1.15))
-            for tf_pooldelta, poolpoints in tfh_extra_pool_weights.items():
+            for tf_pooldelta, pool_weight, poolpoints in zip(tfh_extra_pool_weights.options, tfh_extra_pool_weights.weights, tfh_extra_pool_weights.points):
                 tf_pool = int(tf_goal * (1 + int(tf_pooldelta) / 100) + 1)
                 if tf_pool <= tf_goal:
                     continue
                 if pool_space - tf_pool < 50 or tf_pool / pool_space > 0.8:
                     continue
-                if random.random() > poolpoints['weight']:
+                if random.random() > pool_weight:
                     continue
                 length, variance = simulate_tfh(tf_goal, tf_pool, current_pool_size)
-                familiarity = poolpoints['familiarity']
-                execution = poolpoints['execution']
+                familiarity = poolpoints[FAMILIARITY]
+                execution = poolpoints[EXECUTION]
                 roll_weights.append([tf_goal, tf_pool, length, execution, familiarity, variance])
         return roll_weights
 
-    def better_than_current(new_points:dict) -> bool:
+    def better_than_current(new_points:tuple) -> bool:
         """Determine if the new points are closer to the target than the current score"""
         delta_score = 0
 
@@ -209,13 +1172,13 @@ def make_mystery(input_weights, default_settings, args):
 
         return delta_score > 0
 
-    def item_within_limits(new_points:dict) -> bool:
+    def item_within_limits(new_points:tuple) -> bool:
         """Determine if the new points are within the limits of the input weights"""
         if args.preset in ['chaos']:
-            new_length = score['length'] + new_points['length']
+            new_length = score[LENGTH] + new_points[LENGTH]
             if -2 <= new_length <= 5:
                 return False
-            new_familiarity = score['familiarity'] + new_points['familiarity']
+            new_familiarity = score[FAMILIARITY] + new_points[FAMILIARITY]
             if 8 >= new_familiarity:
                 return False
         for attr, attr_min, attr_max in attrs:
@@ -224,306 +1187,767 @@ def make_mystery(input_weights, default_settings, args):
                 return False
         return True 
     
-    def set_input_weight(setting_name:str, option:str, weight:int) -> None:
-        input_weights[setting_name][option]['weight'] = weight
-
-    attrs = [
-        ('length', args.min_length, args.max_length),
-        ('execution', args.min_execution, args.max_execution),
-        ('familiarity', args.min_familiarity, args.max_familiarity),
-        ('variance', args.min_variance, args.max_variance)
-    ]
-    cached_weights = copy.deepcopy(input_weights)
-    attempts = 0
-    while attempts <= MAX_ATTEMPTS:
-        attempts += 1
-        settings = copy.copy(default_settings)
-        input_weights = copy.deepcopy(cached_weights)
-        set_input_weight('algorithm', 'vanilla_fill', 0)
-        startinventory = []
-        score = {}
-        for attr,_,_ in attrs:
-            score[attr] = 0
-
-        roll_setting('logic')
-        if settings['logic'] != 'noglitches':
-            force_setting('pseudoboots', 'off')
-            startinventory.append('Pegasus Boots')
-            set_input_weight('startinventory', 'Pegasus Boots', 0)
-        if settings['logic'] == 'hybridglitches':
-            force_setting('door_shuffle', 'vanilla') 
-
-        roll_setting('goal')
-        if settings['goal'] in ['triforcehunt', 'ganonhunt', 'trinity']:
-            set_input_weight('algorithm', 'major_only', 0)
-        if settings['goal'] == 'ganonhunt':
-            force_setting('openpyramid', 'on')
-            force_setting('shuffle', 'vanilla')
-        if settings['goal'] == 'completionist':
-            force_setting('accessibility', 'locations')
-            force_setting('mystery', 'off')
-            force_setting('timer', 'none')
-            force_setting('shopsanity', 'off')
-        if settings['goal'] in ('ganon', 'crystals'):
-            roll_setting('crystals_ganon')
-        if settings['goal'] == 'crystals':
-            force_setting('openpyramid', 'on')
-
-        roll_setting('mode')
-        if settings['mode'] == 'standard':
-            set_input_weight('boots_hint', 'on', 1)
-            set_input_weight('boots_hint', 'off', 1)
-            set_input_weight('shuffle', 'insanity', 0)
-            force_setting('flute_mode', 'normal')
-
-        roll_setting('dropshuffle')
-        if settings['dropshuffle'] == 'underworld':
-            force_setting('swords', 'assured')
-            startinventory.extend(['Blue Boomerang'])
-            set_input_weight('startinventory', 'Blue Boomerang', 0)
-            force_setting('timer', 'none')
-        if settings['dropshuffle'] != 'none':
-            set_input_weight('pottery', 'none', 0)
-            set_input_weight('pottery', 'cave', 0)
-        
-
-        roll_setting('timer')
-        if settings['timer'] != 'none':
-            force_setting('shuffleenemies', 'none')
-            force_setting('shufflebosses', 'none')
-            force_setting('beemizer', '0')
-            set_input_weight('pottery', 'dungeon', 0)
-            set_input_weight('pottery', 'reduced', 0)
-            set_input_weight('pottery', 'lottery', 0)
-
-        roll_setting('shuffleenemies')
-        if settings['shuffleenemies'] != 'none' and settings['mode'] == 'standard':
-            force_setting('swords', 'assured')
-        if settings['shuffleenemies'] != 'none':
-            set_input_weight('swords', 'swordless', 0)
-            set_input_weight('enemy_health', 'hard', 0)
-            set_input_weight('enemy_health', 'expert', 0)
-
-        roll_setting('shuffle')
-        if settings['shuffle'] == 'vanilla':
-            force_setting('shuffleganon', 'off')
-            force_setting('shufflelinks', 'off')
-            force_setting('shuffletavern', 'off')
-            force_setting('overworld_map', 'default')
-            force_setting('take_any', 'none')
-        if settings['shuffle'] == 'lean':
-            set_input_weight('pottery', 'lottery', 0)
-            set_input_weight('pottery', 'reduced', 0)
-            set_input_weight('pottery', 'cave', 0)
-            set_input_weight('pottery', 'cavekeys', 0)
-            force_setting('shopsanity', 'off')
-        if settings['shuffle'] == 'insanity':
-            force_setting('bombbag', 'off')
-            startinventory.append('Ocarina')
-            set_input_weight('startinventory', 'Ocarina', 0)
-
-        if settings['shuffle'] != 'vanilla':
-            if settings['goal'] == 'ganonhunt':
-                force_setting('shuffleganon', 'off')
-                force_setting('openpyramid', 'on')
-            else:
-                force_setting('shuffleganon', 'on')
-                force_setting('openpyramid', 'off')
-            if settings['mode'] == 'inverted':
-                force_setting('shufflelinks', 'on')
-            set_input_weight('take_any', 'random', 0)
-            set_input_weight('take_any', 'fixed', 0)
-
-        if settings['shuffle'] == 'vanilla' and settings['goal'] == 'ganon':
-            max_gt = int(settings['crystals_ganon'])
-            for key in input_weights['crystals_gt']:
-                if int(key) > max_gt:
-                    set_input_weight('crystals_gt', key, 0)
-                else:
-                    input_weights['crystals_gt'][key]['length'] = 0
-                    input_weights['crystals_gt'][key]['execution'] = 0
-            roll_setting('crystals_gt')
-        elif settings['shuffle'] == 'vanilla' and settings['goal'] == 'ganonhunt' and settings['openpyramid'] == 0:
-            settings['crystals_gt'] = "0"
-        elif settings['shuffle'] == 'vanilla' and settings['goal'] == 'crystals':
-            settings['crystals_gt'] = str(random.randint(int(settings['crystals_ganon']),7))
-        else:
-            settings['crystals_gt'] = str(random.randint(0,7))
-
-        roll_setting('door_shuffle')
-        if settings['door_shuffle'] != 'vanilla':
-            force_setting('dungeon_counters', 'on')
-            force_setting('trap_door_mode', 'boss')
-            force_setting('accessibility', 'locations')
-            roll_setting('intensity')
-            roll_setting('door_type_mode')
-            roll_setting('decoupledoors')
-            roll_setting('trap_door_mode')
-
-        roll_setting('pottery')
-        if settings['pottery'] not in ('none', 'cave') or settings['dropshuffle'] != 'none':
-            force_setting('dungeon_counters', 'on')
-        if settings['pottery'] not in ('none', 'cave') and settings['dropshuffle'] == 'none':
-            settings['dropshuffle'] = 'keys'
-        if settings['pottery'] != 'none':
-            settings['colorizepots'] = 1
-
-
-        if settings['goal'] not in ['triforcehunt', 'ganonhunt'] and (settings['pottery'] not in ('none', 'cave', 'keys', 'cavekeys') or settings['dropshuffle'] == 'underworld'):
-            set_input_weight('wild_dungeon_items', 'none', 0)
-            set_input_weight('wild_dungeon_items', 'b', 0)
-            set_input_weight('wild_dungeon_items', 'mc', 0)
-            set_input_weight('wild_dungeon_items', 'mcb', 0)
-            set_input_weight('universal_small_keys', 'on', 0)
-
-        roll_setting('wild_dungeon_items')
-        if 'm' in settings['wild_dungeon_items'] and 'c' in settings['wild_dungeon_items'] and 's' in settings['wild_dungeon_items'] and 'b' in settings['wild_dungeon_items']:
-            force_setting('restrict_boss_items', 'none')
-        elif 'm' in settings['wild_dungeon_items'] and 'c' in settings['wild_dungeon_items']:
-            set_input_weight('restrict_boss_items', 'mapcompass', 0)
-        
-        if 'm' in settings['wild_dungeon_items']:
-            settings['mapshuffle'] = 1
-        if 'c' in settings['wild_dungeon_items']:
-            settings['compassshuffle'] = 1
-        if 's' in settings['wild_dungeon_items']:
-            roll_setting('universal_small_keys')
-            settings['keyshuffle'] = 'wild' if settings['universal_small_keys'] == 0 else 'universal'
-            del settings['universal_small_keys']
-        if 'b' in settings['wild_dungeon_items']:
-            settings['bigkeyshuffle'] = 1
-        del settings['wild_dungeon_items']
-
-        if settings['keyshuffle'] != 'universal':
-            set_input_weight('startinventory', 'Small Key (Universal),Small Key (Universal),Small Key (Universal)', 0)
-
-        roll_setting('bow_mode')
-        if settings['bow_mode'] in  ['retro', 'retro_silvers']:
-            input_weights['startinventory']['Bow'] = input_weights['startinventory'].pop('Progressive Bow')
-            set_input_weight('startinventory', 'Arrow Upgrade (+10)', 0)
-
-        roll_setting('difficulty')
-        if settings['difficulty'] in ['hard','expert']:
-            set_input_weight('startinventory', 'Progressive Armor,Progressive Armor', 0)
-
-        roll_setting('bombbag')
-        if settings['bombbag'] == 1:
-            set_input_weight('startinventory', 'Bomb Upgrade (+10)', 0)
-            set_input_weight('startinventory', 'Bombs (10)', 0)
-
-        roll_setting('shopsanity')
-
-        roll_setting('mystery')
-        if settings['shopsanity'] == 0 and settings['pottery'] == 'none' and settings['goal'] != 'completionist' and settings['dropshuffle'] == 'none':
-            force_setting('collection_rate', 'off')
-        roll_setting('collection_rate')
-
-        if settings['pottery'] not in ['none', 'keys'] or settings['dropshuffle'] == 'underworld' or settings['timer'] != 'none':
-            force_setting('beemizer', '0')
-
-        roll_setting('beemizer')
-        roll_setting('key_logic_algorithm')
-        roll_setting('any_enemy_logic')
-        roll_setting('flute_mode')
-        roll_setting('swords')
-        roll_setting('shufflebosses')
-        roll_setting('enemy_damage')
-        roll_setting('enemy_health')
-        roll_setting('boots_hint')
-        roll_setting('restrict_boss_items')
-        roll_setting('overworld_map')
-        roll_setting('shufflelinks')
-        roll_setting('shuffletavern')
-        roll_setting('shuffleganon')
-        roll_setting('openpyramid')
-        roll_setting('experimental')
-        roll_setting('algorithm')
-        roll_setting('dungeon_counters')
-        roll_setting('hints')
-        roll_setting('pseudoboots')
-        roll_setting('item_functionality')
-        roll_setting('progressive')
-        roll_setting('accessibility')
-        roll_setting('take_any')
-
-        if settings['goal'] in ['triforcehunt', 'ganonhunt']:
-            tfh_weights_list = triforcehunt(minimum_pool_size = determine_mandatory_pool_size(), current_pool_size = determine_pool_size())
-            if not tfh_weights_list:
-                continue
-            random.shuffle(tfh_weights_list)
-            cached_score = copy.copy(score)
-            for tfh_weights in tfh_weights_list:
-                score = copy.copy(cached_score)
-                score['length'] = int((tfh_weights[2] * 3 + score['length'])/4)
-                score['execution'] += tfh_weights[3]
-                score['familiarity'] += tfh_weights[4]
-                score['variance'] += tfh_weights[5]
-                if within_limits(score):
-                    break
-            settings['triforce_goal'] = tfh_weights[0]
-            settings['triforce_pool'] = tfh_weights[1]
- 
-        if settings['pseudoboots'] == 1:
-            input_weights['startinventory']['Pegasus Boots']['weight'] = 0
-
-        if settings['mode'] == 'standard' and settings['keyshuffle'] == 'universal':
-            startinventory.append('Small Key (Universal),Small Key (Universal),Small Key (Universal)')
-
+    def fill_start_inventory() -> bool:
+        """Add start items to the attempt's start inventory and score. Returns True if every candidate item was tried."""
+        if stats is not None:
+            pass_start = time.perf_counter()
         # Add items that puts the score within limits
-        start_item_options = [item for item in input_weights['startinventory'].keys() if input_weights['startinventory'][item]['weight'] > 0 and item not in startinventory]
+        start_item_options = [item for item in overlay.options('startinventory') if overlay.weight('startinventory', item) > 0 and item not in startinventory]
         random.shuffle(start_item_options)
         for item in start_item_options:
-            item_weights = input_weights['startinventory'][item]
+            item_weights = overlay.points('startinventory', item)
             if len(startinventory) >= args.max_items or within_limits(score):
                 break
             if better_than_current(item_weights) and random.random() > 0.40:
-                for attr,_,_ in attrs:
-                    score[attr] += item_weights[attr]
+                add_points(score, item_weights)
                 startinventory.append(item)
 
+        if stats is not None:
+            pass_end = time.perf_counter()
+            stats.add_time('inventory_pass1', pass_end - pass_start)
+            pass_start = pass_end
+
         # Add minimum amount of items and bonus items
         start_item_options = [item for item in start_item_options if item not in startinventory]
         random.shuffle(start_item_options)
+        exhausted = False
         for item in start_item_options:
-            item_weights = input_weights['startinventory'][item]
+            item_weights = overlay.points('startinventory', item)
             if len(startinventory) < args.min_items:
                 if item_within_limits(item_weights):
-                    for attr,_,_ in attrs:
-                        score[attr] += item_weights[attr]
+                    add_points(score, item_weights)
                     startinventory.append(item)
             elif len(startinventory) < args.max_items and item_within_limits(item_weights):
                 if random.random() < 0.65:
                     break
-                for attr,_,_ in attrs:
-                    score[attr] += item_weights[attr]
+                add_points(score, item_weights)
+                startinventory.append(item)
+        else:
+            exhausted = True
+        if stats is not None:
+            stats.add_time('inventory_pass2', time.perf_counter() - pass_start)
+        return exhausted
+
+    def solve_start_inventory() -> bool:
+        """Add a random start inventory among the item subsets that put the score within limits. Returns True if there is none."""
+        if stats is not None:
+            solve_start = time.perf_counter()
+        candidates = {}
+        for item in overlay.options('startinventory'):
+            if overlay.weight('startinventory', item) > 0 and item not in startinventory:
+                candidates.setdefault(overlay.points('startinventory', item), []).append(item)
+        groups = tuple(sorted((points, len(items)) for points, items in candidates.items()))
+        most = max(args.max_items - len(startinventory), 0)
+        layers = inventory_table(groups, most)
+
+        # The points totals that end inside the limits box, checked in full for the chaos holes
+        low = [attr_min - score[attr] for attr, attr_min, _ in attrs]
+        high = [attr_max - score[attr] for attr, _, attr_max in attrs]
+        fitting = {}
+        for entry, ways in layers[-1].items():
+            total = entry[1]
+            if (low[LENGTH] <= total[LENGTH] <= high[LENGTH] and low[EXECUTION] <= total[EXECUTION] <= high[EXECUTION]
+                    and low[FAMILIARITY] <= total[FAMILIARITY] <= high[FAMILIARITY] and low[VARIANCE] <= total[VARIANCE] <= high[VARIANCE]
+                    and within_limits([attr_score + attr_points for attr_score, attr_points in zip(score, total)])):
+                fitting.setdefault(entry[0], []).append((entry, ways))
+        # Like the greedy passes, min_items gives way when no subset that large fits
+        fewest = min(max(args.min_items - len(startinventory), 0), most)
+        sizes = [size for size in fitting if size >= fewest] or list(fitting)
+        if sizes:
+            # Each fitting points total is weighted by its number of subsets, so every fitting subset is equally likely
+            entries = [entry for size in sorted(sizes) for entry in fitting[size]]
+            size, total = random.choices([entry for entry, _ in entries], [ways for _, ways in entries])[0]
+            chosen = []
+            for g in reversed(range(len(groups))):
+                points, items = groups[g]
+                takes = []
+                weights = []
+                for taken in range(min(items, size) + 1):
+                    ways = layers[g].get((size - taken, tuple(attr_total - taken * attr_points for attr_total, attr_points in zip(total, points))))
+                    if ways:
+                        takes.append(taken)
+                        weights.append(math.comb(items, taken) * ways)
+                taken = random.choices(takes, weights)[0]
+                chosen.extend(random.sample(candidates[points], taken))
+                size -= taken
+                total = tuple(attr_total - taken * attr_points for attr_total, attr_points in zip(total, points))
+            random.shuffle(chosen)
+            for item in chosen:
+                add_points(score, overlay.points('startinventory', item))
                 startinventory.append(item)
+        if stats is not None:
+            stats.add_time('inventory_solver', time.perf_counter() - solve_start)
+        return not sizes
 
-        if 'Pegasus Boots' in startinventory:
-            settings['boots_hint'] == 'off'
-
-        if startinventory:
-            settings['usestartinventory'] = 1
-            settings['startinventory'] = ','.join(startinventory)  
-
-        if within_limits(score):
-            print_to_stdout(score)
-            print_to_stdout('Filler Algorithm: {}'.format(settings['algorithm']))
-            print_to_stdout('Boss item restriction: {}'.format(settings['restrict_boss_items']))
-            print_to_stdout('Take Any: {}'.format(settings['take_any']))
-            print_to_stdout('Pseudoboots: {}'.format('Yes' if settings['pseudoboots'] == 1 else 'No'))
-            print_to_stdout('Boots Hint: {}'.format('Yes' if settings['boots_hint'] == 1 else 'No'))
-            print_to_stdout('MMMM v2')
-            if 'triforce_pool' in settings:
-                print_to_stdout('Extra TF Pool: {} percent'.format(round(100*(settings['triforce_pool']/settings['triforce_goal']-1),1)))
+    def set_input_weight(setting_name:str, option:str, weight:int) -> None:
+        overlay.set_weight(setting_name, option, weight)
+
+    # The rule_chain() steps of the attempt, applied where their condition is True
+    def chain_value(setting_name:str, *values) -> bool:
+        return settings.get(setting_name) in values
+
+    def chain_other(setting_name:str, *values) -> bool:
+        return settings.get(setting_name) not in values
+
+    def chain_letters(setting_name:str, letters:str) -> bool:
+        return all(letter in settings[setting_name] for letter in letters)
+
+    def chain_force(setting_name:str, choice, rows:bool) -> None:
+        if rows:
+            overlay.force(setting_name, choice)
+
+    def chain_weight(setting_name:str, option:str, weight, rows:bool) -> None:
+        if rows:
+            overlay.set_weight(setting_name, option, weight)
+
+    def chain_cap(setting_name:str, by_setting:str, attrs:tuple, rows:bool) -> None:
+        """Rule out the options above the value of by_setting and take the attrs points off the others"""
+        if rows:
+            most = int(settings[by_setting])
+            for key in overlay.options(setting_name):
+                if int(key) > most:
+                    overlay.set_weight(setting_name, key, 0)
+                else:
+                    for attr in attrs:
+                        overlay.set_points(setting_name, key, attr, 0)
+
+    def chain_assign(setting_name:str, value, rows:bool) -> None:
+        if rows:
+            settings[setting_name] = value
+
+    def chain_pick(setting_name:str, low_setting:str, high:int, rows:bool) -> None:
+        """Set a number from the value of low_setting (0 without one) to high, without rolling it for points"""
+        if rows:
+            settings[setting_name] = str(random.randint(int(settings[low_setting]) if low_setting else 0, high))
+
+    def chain_drop(setting_name:str, rows:bool) -> None:
+        if rows:
+            del settings[setting_name]
+
+    def chain_start_item(item:str, rows:bool) -> None:
+        if rows:
+            startinventory.append(item)
+            overlay.set_weight('startinventory', item, 0)
+
+    def chain_rename(setting_name:str, option:str, new_option:str, rows:bool) -> None:
+        if rows:
+            overlay.rename(setting_name, option, new_option)
+
+    if stats is not None:
+        simulate_tfh = stats.timed(simulate_tfh, 'tfh')
+
+    chain = SimpleNamespace(every=True, value=chain_value, other=chain_other, letters=chain_letters, negate=operator.not_, some=bool,
+                            roll=roll_setting, force=chain_force, weight=chain_weight, cap=chain_cap, assign=chain_assign, pick=chain_pick,
+                            drop=chain_drop, start_item=chain_start_item, rename=chain_rename)
+
+    attrs = attribute_limits(args)
+    tfh_source = tfh_table_source(input_weights)
+    overlay = WeightOverlay(compiled if compiled is not None else compile_weights(input_weights))
+    if args.prune:
+        prune_bounds = pruning_bounds(overlay.base, args)
+    batch = batch_engine(overlay.base, default_settings, args) if args.engine == 'batch' else None
+    if batch is not None and batch_heads is None:
+        batch_heads = BatchHeads()
+    head = None
+    attempts = 0
+    pruned = 0
+    found = False
+    repaired = False
+    repairing = False
+    score = [0] * len(ATTRIBUTES)
+    closest = None
+    while attempts < max_attempts:
+        if should_stop is not None and should_stop():
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            if stats is not None:
+                stats.count('deadline')
             break
+        attempts += 1
+        if stats is not None:
+            attempt_start = time.perf_counter()
+        # With --best-effort, the screen waits like pruning until a first miss is kept
+        if batch is not None and (closest is not None or not args.best_effort):
+            head = batch_heads.next(batch, max_attempts - attempts + 1)
+            if stats is not None:
+                stats.add_time('batch', time.perf_counter() - attempt_start)
+            if head is None:
+                pruned += 1
+                if stats is not None:
+                    stats.reject('batch:screened')
+                continue
+        else:
+            head = None
+        try:
+            settings = copy.copy(default_settings)
+            overlay.reset()
+            startinventory = []
+            rolled = {}
+            score = [0] * len(ATTRIBUTES)
+
+            rule_chain(chain)
+            if stats is not None:
+                stats.add_time('rules', time.perf_counter() - attempt_start)
+
+            if settings['goal'] in ['triforcehunt', 'ganonhunt']:
+                tfh_weights_list = triforcehunt(minimum_pool_size = determine_mandatory_pool_size(), current_pool_size = determine_pool_size())
+                if not tfh_weights_list:
+                    if stats is not None:
+                        stats.reject('tfh:no_candidates')
+                    continue
+                random.shuffle(tfh_weights_list)
+                cached_score = copy.copy(score)
+                for tfh_weights in tfh_weights_list:
+                    score = copy.copy(cached_score)
+                    score[LENGTH] = int((tfh_weights[2] * 3 + score[LENGTH])/4)
+                    score[EXECUTION] += tfh_weights[3]
+                    score[FAMILIARITY] += tfh_weights[4]
+                    score[VARIANCE] += tfh_weights[5]
+                    if within_limits(score):
+                        break
+                settings['triforce_goal'] = tfh_weights[0]
+                settings['triforce_pool'] = tfh_weights[1]
+ 
+            if settings['pseudoboots'] == 1:
+                set_input_weight('startinventory', 'Pegasus Boots', 0)
+
+            if settings['mode'] == 'standard' and settings['keyshuffle'] == 'universal':
+                startinventory.append('Small Key (Universal),Small Key (Universal),Small Key (Universal)')
+
+            exhausted = solve_start_inventory() if args.inventory == 'solver' else fill_start_inventory()
+
+            if stats is not None:
+                check_start = time.perf_counter()
+            # Near misses outside a triforce hunt, whose length is blended with the TFH estimate, get a local repair
+            if args.repair and settings['goal'] not in ['triforcehunt', 'ganonhunt'] and 0 < limit_distance(score, args) <= REPAIR_MARGIN:
+                repaired = repair()
+                if stats is not None:
+                    stats.count('repairs')
+                    stats.count('repaired', repaired)
+
+            if 'Pegasus Boots' in startinventory:
+                settings['boots_hint'] == 'off'
+
+            if startinventory:
+                settings['usestartinventory'] = 1
+                settings['startinventory'] = ','.join(startinventory)  
+
+            accepted = within_limits(score)
+            if stats is not None:
+                stats.add_time('final_check', time.perf_counter() - check_start)
+                if not accepted:
+                    for reason in limit_violations(score, args):
+                        stats.reject(reason)
+                    stats.count('inventory_exhausted', exhausted)
+            if accepted:
+                found = True
+                break
+            if args.best_effort:
+                distance = limit_distance(score, args)
+                if closest is None or distance < closest['distance']:
+                    closest = {'settings': settings, 'score': dict(zip(ATTRIBUTES, score)), 'distance': distance}
+        except AttemptPruned as e:
+            pruned += 1
+            if stats is not None:
+                stats.add_time('rules', time.perf_counter() - attempt_start)
+                stats.reject(pruned_reason(e.args[0]))
+
+    result = {
+        'settings': settings if found else None,
+        'score': dict(zip(ATTRIBUTES, score)),
+        'attempts': attempts,
+        'pruned': pruned,
+        'repaired': found and repaired,
+    }
+    if closest is not None and not found:
+        result['closest'] = closest
+    if stats is not None:
+        stats.count('attempts', attempts)
+        stats.count('pruned', pruned)
+        stats.count('accepted', found)
+        result['stats'] = stats.to_dict()
+    return result
+
+def roll_deadline(args):
+    """The time.monotonic() at which a roll stops searching under --time-budget-ms, or None without a budget.
+
+    The monotonic clock is system wide, so the deadline holds in the worker processes too, and clock changes do not move it.
+    """
+    return time.monotonic() + args.time_budget_ms / 1000 if args.time_budget_ms else None
+
+def closer(first:dict, second:dict) -> dict:
+    """The closer of two 'closest' misses, either of which may be None"""
+    if first is None or (second is not None and second['distance'] < first['distance']):
+        return second
+    return first
+
+def use_closest(result:dict) -> dict:
+    """Return the closest miss of a failed roll in its place, flagged as out_of_limits with its distance from the limits"""
+    closest = result.pop('closest', None)
+    if not result['settings'] and closest is not None:
+        result['settings'] = closest['settings']
+        result['score'] = closest['score']
+        result['out_of_limits'] = True
+        result['distance'] = closest['distance']
+    return result
+
+def derive_seed(seed:int, *path) -> int:
+    """Derive an independent 63 bit seed from a master seed, e.g. for one roll of a batch or one chunk of a roll"""
+    digest = hashlib.sha256(':'.join(str(part) for part in (seed,) + path).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little') >> 1
+
+def seed_rngs(seed:int) -> None:
+    """Seed both the random module and the numpy random state"""
+    global _numpy_seed
+    random.seed(seed)
+    _numpy_seed = seed % 2**32
+    if _numpy is not None:
+        _numpy.random.seed(_numpy_seed)
+
+# Parallel search
+CHUNK_ATTEMPTS = 100
+BATCH_CHUNK_ATTEMPTS = 1000
+_worker = {}
+
+def chunk_attempts(args) -> int:
+    """Attempts per seeded chunk, larger for --engine batch so a chunk fills its batches"""
+    return BATCH_CHUNK_ATTEMPTS if args.engine == 'batch' else CHUNK_ATTEMPTS
+
+def _init_worker(input_weights:dict, default_settings:dict, args, stop_chunk) -> None:
+    _worker['input_weights'] = input_weights
+    _worker['default_settings'] = default_settings
+    _worker['args'] = args
+    _worker['compiled'] = compile_weights(input_weights)
+    _worker['stop_chunk'] = stop_chunk
+
+def _roll_chunk(seed:int, chunk:int, collect_stats:bool = False, deadline:float = None) -> dict:
+    """Run one chunk of attempts, giving up as soon as a lower chunk has found a combination"""
+    seed_rngs(derive_seed(seed, chunk))
+    stop_chunk = _worker['stop_chunk']
+    return roll_mystery(_worker['input_weights'], _worker['default_settings'], _worker['args'], _worker['compiled'],
+                        max_attempts=chunk_attempts(_worker['args']), should_stop=lambda: stop_chunk.value < chunk,
+                        stats=RollStats() if collect_stats else None, deadline=deadline)
+
+class ParallelRoller:
+    """Spread the attempts of each roll over a pool of worker processes.
+
+    The attempts are split into chunks of chunk_attempts(), each seeded from the roll seed and its chunk
+    number. The lowest chunk that finds a combination wins, so the result depends only on the seed and
+    not on the number of workers. Chunks after the lowest success so far are cancelled.
+    """
+    def __init__(self, input_weights:dict, default_settings:dict, args, workers:int):
+        self.workers = workers
+        self.args = args
+        self.chunks = -(-(MAX_ATTEMPTS + 1) // chunk_attempts(args))
+        # Only imported here, rolls without --workers never need them
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        self.stop_chunk = multiprocessing.Value('i', self.chunks)
+        self.executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(input_weights, default_settings, args, self.stop_chunk))
+
+    def __enter__(self) -> 'ParallelRoller':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.executor.shutdown(cancel_futures=True)
+
+    def roll(self, seed:int, stats:RollStats = None, deadline:float = None) -> dict:
+        """Roll one mystery, same result shape as roll_mystery plus the seed. deadline defaults to the --time-budget-ms one."""
+        from concurrent.futures import FIRST_COMPLETED, wait
+        deadline = deadline if deadline is not None else roll_deadline(self.args)
+        self.stop_chunk.value = self.chunks
+        pending = {}
+        results = {}
+        next_chunk = 0
+        while True:
+            while (next_chunk < min(self.chunks, self.stop_chunk.value + 1) and len(pending) < 2 * self.workers
+                   and (deadline is None or time.monotonic() < deadline or next_chunk == 0)):
+                pending[self.executor.submit(_roll_chunk, seed, next_chunk, stats is not None, deadline)] = next_chunk
+                next_chunk += 1
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                chunk = pending.pop(future)
+                results[chunk] = future.result()
+                if results[chunk]['settings'] and chunk < self.stop_chunk.value:
+                    self.stop_chunk.value = chunk
+
+        winner = min((chunk for chunk, result in results.items() if result['settings']), default=max(results))
+        result = results[winner]
+        result['attempts'] = sum(results[chunk]['attempts'] for chunk in range(winner + 1))
+        result['pruned'] = sum(results[chunk]['pruned'] for chunk in range(winner + 1))
+        result['seed'] = seed
+        for chunk in range(winner + 1):
+            result['closest'] = closer(result.get('closest'), results[chunk].get('closest'))
+        if stats is not None:
+            for chunk in range(winner + 1):
+                stats.merge(results[chunk]['stats'])
+            result['stats'] = stats.to_dict()
+        return use_closest(result)
+
+def mystery_metadata(settings:dict) -> dict:
+    """The metadata presented to players after rolling"""
+    metadata = {
+        'algorithm': settings['algorithm'],
+        'restrict_boss_items': settings['restrict_boss_items'],
+        'take_any': settings['take_any'],
+        'pseudoboots': settings['pseudoboots'] == 1,
+        'boots_hint': settings['boots_hint'] == 1,
+        'version': 'MMMM v2',
+    }
+    if 'triforce_pool' in settings:
+        metadata['extra_tf_pool'] = round(100*(settings['triforce_pool']/settings['triforce_goal']-1),1)
+    return metadata
 
-    if within_limits(score):
-        return settings
+def roll_with_seed(input_weights:dict, default_settings:dict, args, seed:int, compiled:dict = None, stats:RollStats = None, deadline:float = None) -> dict:
+    """Roll reproducibly from a seed, with the same chunked seeding as ParallelRoller so both give the same result.
 
-def main():
+    A deadline (by default the --time-budget-ms one) only cuts the search short, a roll found before it is the same as without.
+    """
+    compiled = compiled if compiled is not None else compile_weights(input_weights)
+    deadline = deadline if deadline is not None else roll_deadline(args)
+    attempts = 0
+    pruned = 0
+    closest = None
+    for chunk in range(-(-(MAX_ATTEMPTS + 1) // chunk_attempts(args))):
+        seed_rngs(derive_seed(seed, chunk))
+        result = roll_mystery(input_weights, default_settings, args, compiled, max_attempts=chunk_attempts(args), stats=stats, deadline=deadline)
+        attempts += result['attempts']
+        pruned += result['pruned']
+        closest = closer(closest, result.get('closest'))
+        if result['settings'] or (deadline is not None and time.monotonic() >= deadline):
+            break
+    result['attempts'] = attempts
+    result['pruned'] = pruned
+    result['seed'] = seed
+    result['closest'] = closest
+    return use_closest(result)
+
+def roll(input_weights:dict, default_settings:dict, args, compiled:dict = None, stats:RollStats = None) -> dict:
+    """Roll one mystery the way the arguments ask for: unseeded, seeded, or spread over --workers"""
+    if args.workers:
+        with ParallelRoller(input_weights, default_settings, args, args.workers) as roller:
+            return roller.roll(args.seed if args.seed is not None else random.getrandbits(63), stats)
+    if args.seed is not None:
+        return roll_with_seed(input_weights, default_settings, args, args.seed, compiled, stats)
+    return use_closest(roll_mystery(input_weights, default_settings, args, compiled, stats=stats, deadline=roll_deadline(args)))
+
+def print_result(result:dict) -> None:
+    settings = result['settings']
+    if settings:
+        metadata = mystery_metadata(settings)
+        print_to_stdout(result['score'])
+        print_to_stdout('Filler Algorithm: {}'.format(metadata['algorithm']))
+        print_to_stdout('Boss item restriction: {}'.format(metadata['restrict_boss_items']))
+        print_to_stdout('Take Any: {}'.format(metadata['take_any']))
+        print_to_stdout('Pseudoboots: {}'.format('Yes' if metadata['pseudoboots'] else 'No'))
+        print_to_stdout('Boots Hint: {}'.format('Yes' if metadata['boots_hint'] else 'No'))
+        print_to_stdout(metadata['version'])
+        if 'extra_tf_pool' in metadata:
+            print_to_stdout('Extra TF Pool: {} percent'.format(metadata['extra_tf_pool']))
+
+def make_mystery(input_weights, default_settings, args):
+    result = roll(input_weights, default_settings, args)
+    print_result(result)
+    return result['settings']
+
+def roll_batch(input_weights, default_settings, args, count:int, output, stats:RollStats = None, compiled:dict = None) -> None:
+    """Roll count mysteries from the same preprocessed weights, writing each result as soon as it is found.
+
+    Results are json lines, or with --format yaml one yaml document per mystery and a comment for each failed roll.
+    """
+    if args.format == 'yaml':
+        import MMMM_json2yaml
+    compiled = compiled if compiled is not None else compile_weights(input_weights)
+    roller = ParallelRoller(input_weights, default_settings, args, args.workers) if args.workers else None
+    seed = args.seed if args.seed is not None else random.getrandbits(63) if roller else None
+    batch_heads = BatchHeads()
+    for index in range(count):
+        line = {'index': index, 'preset': args.preset}
+        try:
+            if seed is None:
+                result = use_closest(roll_mystery(input_weights, default_settings, args, compiled, stats=stats, deadline=roll_deadline(args),
+                                                  batch_heads=batch_heads))
+            else:
+                line['seed'] = derive_seed(seed, index)
+                if roller:
+                    result = roller.roll(line['seed'], stats)
+                else:
+                    result = roll_with_seed(input_weights, default_settings, args, line['seed'], compiled, stats)
+        except ValueError as e:
+            line['error'] = str(e)
+        else:
+            line['attempts'] = result['attempts']
+            line['score'] = result['score']
+            if result['settings']:
+                if result.get('out_of_limits'):
+                    line['out_of_limits'] = True
+                    line['distance'] = result['distance']
+                line['metadata'] = mystery_metadata(result['settings'])
+                line['settings'] = result['settings']
+            else:
+                line['error'] = 'No combination found in time.'
+        if args.format == 'yaml':
+            if 'error' in line:
+                output.write(f'# {index}: {line["error"]}\n')
+            else:
+                if line.get('out_of_limits'):
+                    output.write(f'# {index}: out of limits by {line["distance"]} points\n')
+                MMMM_json2yaml.dump(MMMM_json2yaml.convert(line['settings']), output, explicit_start=True)
+        else:
+            output.write(json.dumps(line) + '\n')
+        output.flush()
+    if roller:
+        roller.close()
+
+# Multiworld: several worlds rolled together from the same prepared weights
+_multiworld = {}
+
+def _init_multiworld(input_weights:dict, default_settings:dict) -> None:
+    _multiworld['input_weights'] = input_weights
+    _multiworld['default_settings'] = default_settings
+    _multiworld['variants'] = {}
+
+def _roll_player(args, seed:int, goal:str = None) -> dict:
+    """Roll one world from its seed, with the goal forced for --shared-goal. Weights are compiled once per goal and process."""
+    variant = _multiworld['variants'].get(goal)
+    if variant is None:
+        input_weights = _multiworld['input_weights']
+        if goal is not None:
+            input_weights = dict(input_weights, goal={option: dict(option_weights, weight=1 if option == goal else 0)
+                                                      for option, option_weights in input_weights['goal'].items()})
+        variant = _multiworld['variants'][goal] = (input_weights, compile_weights(input_weights))
+    return roll_with_seed(variant[0], _multiworld['default_settings'], args, seed, variant[1])
+
+def length_window(length:int, spread:int, args, seed:int) -> tuple:
+    """A length window spread wide that contains length at a seeded position, clipped to the length limits.
+
+    A --best-effort first world can miss the limits, so they are widened to its length before clipping.
+    """
+    start = length - random.Random(derive_seed(seed, 'window')).randint(0, spread)
+    return max(start, min(args.min_length, length)), min(start + spread, max(args.max_length, length))
+
+def roll_multiworld(input_weights:dict, default_settings:dict, args, players:int, seed:int, workers:int = None) -> dict:
+    """Roll players worlds from the same prepared weights on a pool of workers processes (in this process for 1).
+
+    Cross-player constraints are turned into limits of the single rolls: the first world is rolled on its own, then
+    --shared-goal forces its goal on every other world and --length-spread narrows their length limits to a window
+    of that width around its length. The other worlds roll independently and in parallel, so the time grows with
+    players / workers. Every world is seeded from the master seed and its number, so the result depends only on it.
+    """
+    seeds = [derive_seed(seed, 'player', player) for player in range(players)]
+    workers = min(workers or os.cpu_count() or 1, players)
+    # The first world of a constrained multiworld is rolled in this process before any worker is started,
+    # the others need its goal and length, and none are rolled when it fails
+    _init_multiworld(input_weights, default_settings)
+    constrained = args.shared_goal or args.length_spread is not None
+    first = _roll_player(args, seeds[0]) if constrained else None
+    goal = None
+    player_args = args
+    if first is not None and first['settings']:
+        if args.shared_goal:
+            goal = first['settings']['goal']
+        if args.length_spread is not None:
+            player_args = copy.copy(args)
+            player_args.min_length, player_args.max_length = length_window(first['score']['length'], args.length_spread, args, seed)
+    if first is not None and not first['settings']:
+        rest = []
+    elif workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(workers, initializer=_init_multiworld, initargs=(input_weights, default_settings)) as executor:
+            rest = list(executor.map(_roll_player, [player_args] * (players - 1 if constrained else players),
+                                     seeds[1:] if constrained else seeds, [goal] * players))
+    else:
+        rest = [_roll_player(player_args, player_seed, goal) for player_seed in (seeds[1:] if constrained else seeds)]
+    results = ([first] if constrained else []) + rest
+    lengths = [result['score']['length'] for result in results if result['settings']]
+    return {
+        'seed': seed,
+        'players': results,
+        'complete': len(lengths) == players,
+        'goal': goal,
+        'length_window': [player_args.min_length, player_args.max_length] if player_args is not args else None,
+        'length_spread': max(lengths) - min(lengths) if lengths else None,
+    }
+
+def write_multiworld(multiworld:dict, args, output) -> None:
+    """Write a multiworld as one json document, or with --format yaml one yaml document per world"""
+    if args.format == 'yaml':
+        import MMMM_json2yaml
+        for player, result in enumerate(multiworld['players'], 1):
+            output.write(f'# Player {player}: {result["score"]}\n' if result['settings'] else f'# Player {player}: No combination found in time.\n')
+            if result['settings']:
+                MMMM_json2yaml.dump(MMMM_json2yaml.convert(result['settings']), output, explicit_start=True)
+        return
+    worlds = [{'player': player, 'seed': result['seed'], 'score': result['score'], 'settings': result['settings'],
+               **({'out_of_limits': True, 'distance': result['distance']} if result.get('out_of_limits') else {})}
+              for player, result in enumerate(multiworld['players'], 1)]
+    output.write(json.dumps(dict(multiworld, players=worlds), indent=4))
+
+# Arguments that change the result of a seeded roll
+RESULT_ARGS = ('preset', 'min_length', 'max_length', 'min_execution', 'max_execution', 'min_familiarity', 'max_familiarity',
+               'min_variance', 'max_variance', 'min_items', 'max_items', 'multi', 'tfh', 'prune', 'repair', 'inventory', 'engine')
+
+def file_digest(path:str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def setting_options(argument:str) -> list:
+    """The (setting, option) pairs of a comma separated --force or --veto argument, in order and as given"""
+    return [tuple(setting_option.split(':', 1)) for setting_option in (argument or '').split(',') if ':' in setting_option]
+
+def weight_edits(args) -> tuple:
+    """The --force and --veto pairs prepare_weights() applies, sorted, the last force of a setting winning"""
+    return sorted(dict(setting_options(args.force)).items()), sorted(set(setting_options(args.veto)))
+
+def request_key(weights_digest:str, base_digest:str, args, seed:int) -> str:
+    """Cache key of a seeded roll: both input files, the normalized arguments and the seed"""
+    forced, vetoed = weight_edits(args)
+    request = {
+        'weights': weights_digest,
+        'base': base_digest,
+        'args': {arg: getattr(args, arg) for arg in RESULT_ARGS},
+        'force': forced,
+        'veto': vetoed,
+        'seed': seed,
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+
+class ResultCache:
+    """LRU cache of roll results, optionally persisted as one json file per result in a directory"""
+    def __init__(self, maxsize:int = 1024, directory:str = None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key:str):
+        with self.lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.entries.move_to_end(key)
+            elif self.directory:
+                path = os.path.join(self.directory, key + '.json')
+                try:
+                    with open(path, "r", encoding='utf-8') as f:
+                        result = json.load(f)
+                    os.utime(path)
+                except (FileNotFoundError, json.JSONDecodeError):
+                    pass
+                else:
+                    self._remember(key, result)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return copy.deepcopy(result)
+
+    def put(self, key:str, result:dict) -> None:
+        with self.lock:
+            self._remember(key, copy.deepcopy(result))
+            if self.directory:
+                path = os.path.join(self.directory, key + '.json')
+                with open(path + '.tmp', "w", encoding='utf-8') as f:
+                    f.write(json.dumps(result))
+                os.replace(path + '.tmp', path)
+                self._evict_files()
+
+    def _remember(self, key:str, result:dict) -> None:
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def _evict_files(self) -> None:
+        paths = [entry.path for entry in os.scandir(self.directory) if entry.name.endswith('.json')]
+        if len(paths) > self.maxsize:
+            paths.sort(key=os.path.getmtime)
+            for path in paths[:len(paths) - self.maxsize]:
+                os.remove(path)
+
+RESERVOIR_DIR = 'MMMM_reservoir'
+
+class Reservoir:
+    """On-disk store of pre-rolled, accepted mysteries, one directory per roll variant (the request_key without a seed).
+
+    take() hands out any stored roll in O(1) by renaming it away first, so every roll is served only once, also
+    across processes. The store belongs to one pair of weights and base files and is emptied when either changes.
+    """
+    def __init__(self, directory:str, weights_digest:str, base_digest:str):
+        self.directory = directory
+        self.digests = (weights_digest, base_digest)
+        os.makedirs(directory, exist_ok=True)
+        manifest = os.path.join(directory, 'digests.json')
+        try:
+            with open(manifest, "r", encoding='utf-8') as f:
+                current = tuple(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            current = None
+        if current != self.digests:
+            import shutil
+            for entry in os.scandir(directory):
+                if entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            with open(manifest + '.tmp', "w", encoding='utf-8') as f:
+                json.dump(self.digests, f)
+            os.replace(manifest + '.tmp', manifest)
+
+    def variant_dir(self, args) -> str:
+        return os.path.join(self.directory, request_key(*self.digests, args, None))
+
+    def take(self, args):
+        """A stored roll of the variant of args, removed from the store, or None if it is empty"""
+        path = self.variant_dir(args)
+        try:
+            entries = os.scandir(path)
+        except FileNotFoundError:
+            return None
+        with entries:
+            for entry in entries:
+                if not entry.name.endswith('.json'):
+                    continue
+                claimed = entry.path[:-len('.json')] + '.taken'
+                try:
+                    os.rename(entry.path, claimed)
+                except FileNotFoundError:
+                    # Another process took it first
+                    continue
+                try:
+                    with open(claimed, "r", encoding='utf-8') as f:
+                        return json.load(f)
+                except json.JSONDecodeError:
+                    continue
+                finally:
+                    os.remove(claimed)
+        return None
+
+    def put(self, args, result:dict) -> None:
+        path = self.variant_dir(args)
+        os.makedirs(path, exist_ok=True)
+        name = os.path.join(path, f'{time.time_ns()}-{os.getpid()}-{random.getrandbits(32):08x}')
+        with open(name + '.tmp', "w", encoding='utf-8') as f:
+            f.write(json.dumps(result))
+        os.replace(name + '.tmp', name + '.json')
+
+    def count(self, args) -> int:
+        try:
+            with os.scandir(self.variant_dir(args)) as entries:
+                return sum(1 for entry in entries if entry.name.endswith('.json'))
+        except FileNotFoundError:
+            return 0
+
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(add_help=True)
     parser.add_argument('-i', help='Path to the points weights file to use for rolling game settings')
-    parser.add_argument('-o', help='Output path for the rolled mystery json')
+    parser.add_argument('-o', help='Output path for the rolled mystery json (or yaml)')
     parser.add_argument('-d', help='Default settings')
     parser.add_argument('--force', help='setting1:option,setting2:option')
     parser.add_argument('--veto', help='setting1:option,setting2:option')
@@ -539,25 +1963,31 @@ def main():
     parser.add_argument('--min_items', help='', type=int)
     parser.add_argument('--max_items', help='', type=int)
     parser.add_argument('--multi', help='This flag does some minimal balancing for multiworlds', action='store_true')
-
-    args = parser.parse_args()
-
-    weight_file = args.i if args.i else "MMMM_weights.json"
-    default_file = args.d if args.d else "MMMM_base.json"
-    output_file = args.o if args.o else "MMMM_mystery.json"
-    presets = {
-        'friendly': {'min_length': -6, 'max_length': 2, 'min_execution': -5, 'max_execution': 3, 'min_familiarity': -5, 'max_familiarity': 8, 'min_variance': -2, 'max_variance': 8, 'min_items': 1, 'max_items': 5},
-        'notslow': {'min_length': -2, 'max_length': 5, 'min_execution': -2, 'max_execution': 4, 'min_familiarity': 2, 'max_familiarity': 15, 'min_variance': -5, 'max_variance': 5, 'min_items': 0, 'max_items': 3},
-        'complex': {'min_length': 3, 'max_length': 12, 'min_execution': 0, 'max_execution': 6, 'min_familiarity': 8, 'max_familiarity': 20, 'min_variance': -8, 'max_variance': 5, 'min_items': 0, 'max_items': 3},
-        'ordeal': {'min_length': 13, 'max_length': 25, 'min_execution': 4, 'max_execution': 11, 'min_familiarity': 16, 'max_familiarity': 30, 'min_variance': -8, 'max_variance': 5, 'min_items': 0, 'max_items': 2},
-        'chaos': {'min_length': -100, 'max_length': 100, 'min_execution': -100, 'max_execution': 100, 'min_familiarity': -100, 'max_familiarity': 100, 'min_variance': -100, 'max_variance': 100, 'min_items': 3, 'max_items': 8},
-        'volatility': {'min_length': -100, 'max_length': 100, 'min_execution': -100, 'max_execution': 100, 'min_familiarity': -100, 'max_familiarity': 100, 'min_variance': 10, 'max_variance': 100, 'min_items': 0, 'max_items': 8},
-        'custom': {'min_length': -100, 'max_length': 100, 'min_execution': -100, 'max_execution': 100, 'min_familiarity': -100, 'max_familiarity': 100, 'min_variance': 10, 'max_variance': 100, 'min_items': 0, 'max_items': 2}
-    }
-
-    args.preset = args.preset if args.preset in presets else 'custom'
-
-    preset = presets.get(args.preset, {})
+    parser.add_argument('--tfh', help='analytic (closed form, from the TFH table when built) or simulate', choices=['analytic', 'simulate'], default='analytic')
+    parser.add_argument('--players', help='Roll a multiworld of this many worlds in parallel on --workers processes (default: every cpu), implies --multi', type=int)
+    parser.add_argument('--length-spread', help='With --players, the most the length scores of two worlds may differ by', type=int)
+    parser.add_argument('--shared-goal', help='With --players, give every world the same goal', action='store_true')
+    parser.add_argument('--count', help='Roll this many mysteries and write them as json lines (or a yaml stream) to -o, or stdout', type=int)
+    parser.add_argument('--format', help='Write the mystery settings as json, or as the mystery yaml of MMMM_json2yaml.py (needs pyyaml)', choices=['json', 'yaml'], default='json')
+    parser.add_argument('--workers', help='Spread the attempts of each roll over this many worker processes', type=int)
+    parser.add_argument('--seed', help='Seed for a reproducible roll, or the master seed of a --count batch', type=int)
+    parser.add_argument('--compiled-dir', help=f'Load the preprocessed weights of each preset variant from this directory, rebuilding stale ones (default: {COMPILED_DIR} if it exists)')
+    parser.add_argument('--cache-dir', help='Keep seeded rolls in this directory and serve repeated requests from it')
+    parser.add_argument('--reservoir', help=f'Serve unseeded rolls from the pre-rolled mysteries in this directory when it has one (filled by MMMM_reservoir.py, e.g. {RESERVOIR_DIR})')
+    parser.add_argument('--prune', help='Abandon attempts as soon as their score can no longer end inside the limits', action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument('--inventory', help='Fill the start inventory with the two randomized greedy passes, or draw it from the item subsets that fit the limits (uniformly among all of them)', choices=['greedy', 'solver'], default='greedy')
+    parser.add_argument('--engine', help='Roll attempts one by one, or in NumPy batches screened against the limits before the TFH simulation and start inventory', choices=['scalar', 'batch'], default='scalar')
+    parser.add_argument('--stats', help='Write phase timers, counters and rejection reasons as json to this path')
+    parser.add_argument('--time-budget-ms', help='Stop searching after this many milliseconds of wall-clock time', type=int)
+    parser.add_argument('--best-effort', help='When no combination is found, return the closest roll seen, flagged as out of limits', action='store_true')
+    parser.add_argument('--repair', help='Re-roll independent settings of attempts that just miss the limits instead of starting over', action='store_true')
+    return parser
+
+def apply_preset(args) -> None:
+    """Fill in every limit not given on the command line from the preset"""
+    args.preset = args.preset if args.preset in PRESETS else 'custom'
+
+    preset = PRESETS.get(args.preset, {})
     args.min_length = args.min_length if args.min_length else preset.get('min_length', 0)
     args.max_length = args.max_length if args.max_length else preset.get('max_length', 0)
     args.min_execution = args.min_execution if args.min_execution else preset.get('min_execution', 0)
@@ -568,12 +1998,11 @@ def main():
     args.max_variance = args.max_variance if args.max_variance else preset.get('max_variance', 0)
     args.min_items = args.min_items if args.min_items else preset.get('min_items', 0)
     args.max_items = args.max_items if args.max_items else preset.get('max_items', 0)
+    if args.players:
+        args.multi = True
 
-    with open(weight_file, "r", encoding='utf-8') as f:
-        input_weights = json.load(f)
-    with open(default_file, "r", encoding='utf-8') as f:
-        default_settings = json.load(f)
-
+def prepare_weights(input_weights:dict, args, log=print_to_stdout) -> None:
+    """Apply the preset, --force, --veto and --multi edits to the weights"""
     if args.preset in ['friendly', 'notslow']:
         input_weights['door_shuffle']['vanilla']['weight'] = 100
         input_weights['door_shuffle']['basic']['weight'] = 0
@@ -592,20 +2021,16 @@ def main():
         input_weights['pseudoboots']['off']['weight'] = 0
 
     if args.force:
-        forced_settings = args.force.split(',')
-        forced_settings = [s.split(':') for s in forced_settings if ':' in s]
-        for setting, option in forced_settings:
+        for setting, option in setting_options(args.force):
             if setting in input_weights and option in input_weights[setting]:
-                print_to_stdout(f'Forcing {setting}: {option}')
+                log(f'Forcing {setting}: {option}')
                 for key in input_weights[setting]:
                     input_weights[setting][key]['weight'] = 1 if key == option else 0
 
     if args.veto:
-        vetod_settings = args.veto.split(',')
-        vetod_settings = [s.split(':') for s in vetod_settings if ':' in s]
-        for setting,option in vetod_settings:
+        for setting, option in setting_options(args.veto):
             if setting in input_weights and option in input_weights[setting]:
-                print_to_stdout(f'Vetoing {setting}: {option}')
+                log(f'Vetoing {setting}: {option}')
                 input_weights[setting][option]['weight'] = 0
 
     if args.multi:
@@ -619,14 +2044,141 @@ def main():
         input_weights['mystery']['on']['weight'] = 0
         input_weights['mystery']['off']['weight'] = 1
 
-    mystery_settings = make_mystery(input_weights, default_settings, args)
+def write_stats(path:str, stats:RollStats) -> None:
+    if stats is not None:
+        with open(path, "w+", encoding='utf-8') as f:
+            f.write(json.dumps(stats.to_dict(), indent=4))
+
+# Compiled weights artifacts: one pickle per preset/--force/--veto/--multi variant with prepare_weights() already applied.
+# They hold plain data only, so unpickling never imports this module again (or asks for __main__ when built by the CLI),
+# and the CompiledSetting objects are rebuilt on load, which costs well under a millisecond.
+COMPILED_DIR = 'MMMM_compiled'
+COMPILED_VERSION = 2
+
+def variant_path(directory:str, args) -> str:
+    forced, vetoed = weight_edits(args)
+    variant = {'version': COMPILED_VERSION, 'preset': args.preset, 'force': forced, 'veto': vetoed, 'multi': args.multi}
+    digest = hashlib.sha1(json.dumps(variant, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(directory, f'{args.preset}-{digest[:12]}.bin')
+
+def build_compiled(input_weights:dict, args, source:str) -> dict:
+    """Prepare the weights of one variant, keeping the log lines so loading the artifact can repeat them"""
+    log = []
+    prepare_weights(input_weights, args, log=log.append)
+    return {
+        'version': COMPILED_VERSION,
+        'source': source,
+        'log': log,
+        'input_weights': input_weights,
+    }
+
+def load_compiled(weight_file:str, args, directory:str, log=print_to_stdout) -> tuple:
+    """The prepared and compiled weights of the variant the arguments ask for, as (input_weights, compiled).
+
+    The artifact in directory is used if it was built from the current contents of weight_file, otherwise
+    it is rebuilt and written back. A directory that cannot be written to only costs the rebuild.
+    """
+    with open(weight_file, "rb") as f:
+        raw = f.read()
+    source = hashlib.sha256(raw).hexdigest()
+    path = variant_path(directory, args)
+    try:
+        with open(path, "rb") as f:
+            artifact = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        artifact = None
+    if not isinstance(artifact, dict) or artifact.get('version') != COMPILED_VERSION or artifact.get('source') != source:
+        artifact = build_compiled(json.loads(raw), args, source)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(path + '.tmp', "wb") as f:
+                pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+    for line in artifact['log']:
+        log(line)
+    return artifact['input_weights'], compile_weights(artifact['input_weights'])
+
+def load_weights(weight_file:str, args, compiled_dir:str = None, log=print_to_stdout) -> tuple:
+    """Read, prepare and compile the weights for the arguments, through the compiled artifacts when compiled_dir is given"""
+    if compiled_dir:
+        return load_compiled(weight_file, args, compiled_dir, log)
+    with open(weight_file, "r", encoding='utf-8') as f:
+        input_weights = json.load(f)
+    prepare_weights(input_weights, args, log)
+    return input_weights, compile_weights(input_weights)
+
+def main():
+    args = build_parser().parse_args()
+    apply_preset(args)
+
+    weight_file = args.i if args.i else "MMMM_weights.json"
+    default_file = args.d if args.d else "MMMM_base.json"
+    output_file = args.o if args.o else "MMMM_mystery.yaml" if args.format == 'yaml' else "MMMM_mystery.json"
+    compiled_dir = args.compiled_dir if args.compiled_dir else COMPILED_DIR if os.path.isdir(COMPILED_DIR) else None
+
+    with open(default_file, "r", encoding='utf-8') as f:
+        default_settings = json.load(f)
+    cache = ResultCache(directory=args.cache_dir) if args.cache_dir and args.seed is not None else None
+    stats = RollStats() if args.stats else None
+
+    if args.players:
+        input_weights, _ = load_weights(weight_file, args, compiled_dir, log=print_to_stderr)
+        seed = args.seed if args.seed is not None else random.getrandbits(63)
+        multiworld = roll_multiworld(input_weights, default_settings, args, args.players, seed, args.workers)
+        for player, result in enumerate(multiworld['players'], 1):
+            print_to_stderr(f'Player {player}: {result["score"]}' if result['settings'] else f'Player {player}: No combination found in time.')
+        output_file = args.o if args.o else "MMMM_multiworld.yaml" if args.format == 'yaml' else "MMMM_multiworld.json"
+        with open(output_file, "w+", encoding='utf-8') as f:
+            write_multiworld(multiworld, args, f)
+        if not multiworld['complete']:
+            sys.exit(f"No combination found in time for every world, wrote the others to {output_file}.")
+        print_to_stderr(f'Successfully generated {args.players} worlds: {output_file}')
+        return
+
+    if args.count:
+        if args.o:
+            input_weights, compiled = load_weights(weight_file, args, compiled_dir)
+            with open(args.o, "w+", encoding='utf-8') as f:
+                roll_batch(input_weights, default_settings, args, args.count, f, stats, compiled)
+        else:
+            input_weights, compiled = load_weights(weight_file, args, compiled_dir, log=print_to_stderr)
+            roll_batch(input_weights, default_settings, args, args.count, sys.stdout, stats, compiled)
+        write_stats(args.stats, stats)
+        return
+
+    result = None
+    if cache:
+        key = request_key(file_digest(weight_file), file_digest(default_file), args, args.seed)
+        result = cache.get(key)
+        if result is not None:
+            print_to_stdout(f'Serving cached roll for seed {args.seed}')
+    elif args.reservoir and args.seed is None:
+        result = Reservoir(args.reservoir, file_digest(weight_file), file_digest(default_file)).take(args)
+        if result is not None:
+            print_to_stdout(f'Serving pre-rolled seed {result["seed"]}')
+    if result is None:
+        input_weights, compiled = load_weights(weight_file, args, compiled_dir)
+        result = roll(input_weights, default_settings, args, compiled, stats)
+        if cache and result['settings'] and not result.get('out_of_limits'):
+            cache.put(key, result)
+    print_result(result)
+    write_stats(args.stats, stats)
+    mystery_settings = result['settings']
     if not mystery_settings:
         sys.exit("No combination found in time.")
 
+    if result.get('out_of_limits'):
+        print_to_stdout(f'No combination found in time, using the closest roll, {result["distance"]} points outside the limits.')
     print_to_stdout('Successfully generated mystery settings: {}'.format(output_file))
 
     with open(output_file, "w+", encoding='utf-8') as f:
-        f.write(json.dumps(mystery_settings, indent=4))
+        if args.format == 'yaml':
+            import MMMM_json2yaml
+            MMMM_json2yaml.dump(MMMM_json2yaml.convert(mystery_settings), f)
+        else:
+            f.write(json.dumps(mystery_settings, indent=4))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,200 @@
+import json
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import MMMM
+
+# Settings whose joint frequencies are reported by default, the ones players see before the seed is generated
+FOCUS_SETTINGS = ['algorithm', 'restrict_boss_items', 'take_any', 'pseudoboots', 'boots_hint']
+CHUNK_ROLLS = 250
+
+class Tally:
+    """Streaming counts over rolled mysteries.
+
+    Only counts per setting value, value pair, score and rejection reason are kept, so the memory depends
+    on the option space and never on the number of rolls. Start inventories are counted per item.
+    """
+    def __init__(self, pairs:list, items:list):
+        self.pairs = [(first, second) for index, first in enumerate(pairs) for second in pairs[index + 1:]]
+        self.items = items
+        self.rolls = 0
+        self.accepted = 0
+        self.attempts = 0
+        self.pruned = 0
+        self.settings = {}
+        self.joint = {}
+        self.scores = {attr: {} for attr in MMMM.ATTRIBUTES}
+        self.start_items = {}
+        self.stats = MMMM.RollStats()
+
+    def add(self, result:dict) -> None:
+        self.rolls += 1
+        self.attempts += result['attempts']
+        self.pruned += result['pruned']
+        settings = result['settings']
+        if not settings:
+            return
+        self.accepted += 1
+        for attr, value in result['score'].items():
+            self.scores[attr][value] = self.scores[attr].get(value, 0) + 1
+        for setting_name, value in settings.items():
+            if setting_name != 'startinventory':
+                counts = self.settings.setdefault(setting_name, {})
+                counts[str(value)] = counts.get(str(value), 0) + 1
+        for first, second in self.pairs:
+            key = f'{first}|{second}'
+            value = f'{settings.get(first)}|{settings.get(second)}'
+            counts = self.joint.setdefault(key, {})
+            counts[value] = counts.get(value, 0) + 1
+        # Items are joined with commas and some contain commas themselves, so each known item is matched between separators
+        inventory = ',' + settings['startinventory'] + ',' if 'startinventory' in settings else ''
+        chosen = [item for item in self.items if ',' + item + ',' in inventory]
+        for item in chosen:
+            self.start_items[item] = self.start_items.get(item, 0) + 1
+        counts = self.settings.setdefault('startinventory:count', {})
+        counts[str(len(chosen))] = counts.get(str(len(chosen)), 0) + 1
+
+    def to_dict(self) -> dict:
+        return {
+            'rolls': self.rolls,
+            'accepted': self.accepted,
+            'attempts': self.attempts,
+            'pruned': self.pruned,
+            'settings': self.settings,
+            'joint': self.joint,
+            'scores': {attr: {str(value): count for value, count in counts.items()} for attr, counts in self.scores.items()},
+            'start_items': self.start_items,
+            'stats': self.stats.to_dict(),
+        }
+
+    def merge(self, tally:dict) -> None:
+        """Add the to_dict() output of another Tally, e.g. from a worker process"""
+        self.rolls += tally['rolls']
+        self.accepted += tally['accepted']
+        self.attempts += tally['attempts']
+        self.pruned += tally['pruned']
+        for mine, theirs in ((self.settings, tally['settings']), (self.joint, tally['joint'])):
+            for name, values in theirs.items():
+                counts = mine.setdefault(name, {})
+                for value, count in values.items():
+                    counts[value] = counts.get(value, 0) + count
+        for attr, values in tally['scores'].items():
+            for value, count in values.items():
+                self.scores[attr][int(value)] = self.scores[attr].get(int(value), 0) + count
+        for item, count in tally['start_items'].items():
+            self.start_items[item] = self.start_items.get(item, 0) + count
+        self.stats.merge(tally['stats'])
+
+    def report(self, seconds:float, top:int) -> dict:
+        """Frequencies relative to the accepted rolls, the focus settings and their pairs first"""
+        def frequencies(counts:dict, by_value:bool = False) -> dict:
+            ordered = sorted(counts.items()) if by_value else sorted(counts.items(), key=lambda item: -item[1])
+            return {str(value): round(count / self.accepted, 4) for value, count in ordered}
+
+        focus = [setting_name for pair in self.pairs for setting_name in pair]
+        settings = sorted(self.settings, key=lambda setting_name: (setting_name not in focus, setting_name))
+        rejections = self.stats.rejections
+        return {
+            'rolls': self.rolls,
+            'seconds': round(seconds, 1),
+            'rolls_per_second': round(self.rolls / seconds, 1) if seconds else None,
+            'acceptance': {
+                'accepted': self.accepted,
+                'roll_rate': round(self.accepted / self.rolls, 4) if self.rolls else None,
+                'attempt_rate': round(self.accepted / self.attempts, 4) if self.attempts else None,
+                'attempts_per_roll': round(self.attempts / self.rolls, 2) if self.rolls else None,
+                'pruned_share': round(self.pruned / self.attempts, 4) if self.attempts else None,
+                'rejections': {reason: round(count / self.attempts, 4) for reason, count in sorted(rejections.items(), key=lambda item: -item[1])[:top]},
+            },
+            'settings': {setting_name: frequencies(self.settings[setting_name]) for setting_name in settings} if self.accepted else {},
+            'pairs': {pair: frequencies(counts) for pair, counts in self.joint.items()} if self.accepted else {},
+            'start_items': frequencies(self.start_items) if self.accepted else {},
+            'scores': {attr: frequencies(counts, by_value=True) for attr, counts in self.scores.items()} if self.accepted else {},
+        }
+
+# Worker process state, set up once per process
+_analysis = {}
+
+def _init_analysis(input_weights:dict, default_settings:dict, args, pairs:list) -> None:
+    _analysis['input_weights'] = input_weights
+    _analysis['default_settings'] = default_settings
+    _analysis['args'] = args
+    _analysis['compiled'] = MMMM.compile_weights(input_weights)
+    _analysis['pairs'] = pairs
+
+def _analyze_chunk(seed:int, start:int, count:int) -> dict:
+    """Roll count mysteries seeded from the master seed and their index, and return their tally"""
+    input_weights = _analysis['input_weights']
+    tally = Tally(_analysis['pairs'], list(input_weights['startinventory']) + ['Bow'])
+    for index in range(start, start + count):
+        tally.add(MMMM.roll_with_seed(input_weights, _analysis['default_settings'], _analysis['args'], MMMM.derive_seed(seed, index),
+                                      _analysis['compiled'], tally.stats))
+    return tally.to_dict()
+
+def analyze(input_weights:dict, default_settings:dict, args, rolls:int, seed:int, workers:int, pairs:list, progress=None) -> Tally:
+    """Roll and tally rolls mysteries in chunks of CHUNK_ROLLS, on workers processes (in this process for 1).
+
+    Every roll is seeded from the master seed and its index, so the tally depends only on the seed. At most two
+    chunks per worker are queued at a time and each is merged as soon as it is done.
+    """
+    tally = Tally(pairs, list(input_weights['startinventory']) + ['Bow'])
+    chunks = [(start, min(CHUNK_ROLLS, rolls - start)) for start in range(0, rolls, CHUNK_ROLLS)]
+    if workers <= 1:
+        _init_analysis(input_weights, default_settings, args, pairs)
+        for start, count in chunks:
+            tally.merge(_analyze_chunk(seed, start, count))
+            if progress:
+                progress(tally)
+        return tally
+    with ProcessPoolExecutor(workers, initializer=_init_analysis, initargs=(input_weights, default_settings, args, pairs)) as executor:
+        pending = set()
+        while chunks or pending:
+            while chunks and len(pending) < 2 * workers:
+                start, count = chunks.pop(0)
+                pending.add(executor.submit(_analyze_chunk, seed, start, count))
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                tally.merge(future.result())
+            if progress:
+                progress(tally)
+    return tally
+
+def main():
+    parser = argparse.ArgumentParser(add_help=True, description='Any other arguments are MMMM.py roll arguments, e.g. --preset ordeal')
+    parser.add_argument('--rolls', help='Mysteries to roll', type=int, default=10000)
+    parser.add_argument('--workers', help='Worker processes (default: every cpu)', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', help='Master seed of the rolls', type=int)
+    parser.add_argument('--pairs', help='Comma separated settings whose pairwise frequencies are reported', default=','.join(FOCUS_SETTINGS))
+    parser.add_argument('--top', help='Rejection reasons to report', type=int, default=10)
+    parser.add_argument('-o', help='Write the report to this path instead of stdout')
+    args, roll_argv = parser.parse_known_args()
+    roll_args = MMMM.build_parser().parse_args(roll_argv)
+    MMMM.apply_preset(roll_args)
+
+    weight_file = roll_args.i if roll_args.i else "MMMM_weights.json"
+    default_file = roll_args.d if roll_args.d else "MMMM_base.json"
+    compiled_dir = roll_args.compiled_dir if roll_args.compiled_dir else MMMM.COMPILED_DIR if os.path.isdir(MMMM.COMPILED_DIR) else None
+    with open(default_file, "r", encoding='utf-8') as f:
+        default_settings = json.load(f)
+    input_weights, _ = MMMM.load_weights(weight_file, roll_args, compiled_dir, log=MMMM.print_to_stderr)
+    seed = args.seed if args.seed is not None else random.getrandbits(63)
+
+    def progress(tally:Tally) -> None:
+        print(f'\r{tally.rolls}/{args.rolls} rolls', end='', file=sys.stderr, flush=True)
+
+    start = time.perf_counter()
+    tally = analyze(input_weights, default_settings, roll_args, args.rolls, seed, args.workers, args.pairs.split(','), progress)
+    print(file=sys.stderr)
+    report = {'preset': roll_args.preset, 'seed': seed, **tally.report(time.perf_counter() - start, args.top)}
+    if args.o:
+        with open(args.o, "w+", encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,447 @@
+import json
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+import MMMM
+
+# (goal, pool, total) triples spanning the pool sizes triforcehunt() actually sees:
+# vanilla pool, keydrops + shopsanity, pottery keys/dungeon, lottery and underworld dropshuffle
+TFH_CASES = [
+    (25, 36, 216),
+    (40, 57, 216),
+    (69, 98, 261),
+    (45, 63, 461),
+    (120, 168, 713),
+    (200, 281, 1035),
+    (280, 393, 1519),
+    (470, 659, 2519),
+]
+
+def time_call(func, repeat:int) -> float:
+    """Return the mean wall time of func() in milliseconds"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def bench_tfh(args) -> list:
+    """Compare the per-call latency and output of the shuffle and vectorized TFH simulations"""
+    rows = []
+    for goal, pool, total in TFH_CASES:
+        cpm = MMMM.tfh_checks_per_minute(total, False, False)
+        np.random.seed(args.seed)
+        shuffle_ms = time_call(lambda: MMMM.simulate_tfh_checks_shuffle(goal, pool, total), args.repeat)
+        shuffle_points = MMMM.tfh_points(*MMMM.simulate_tfh_checks_shuffle(goal, pool, total), cpm)
+        np.random.seed(args.seed)
+        vectorized_ms = time_call(lambda: MMMM.simulate_tfh_checks(goal, pool, total, cpm), args.repeat)
+        vectorized_points = MMMM.tfh_points(*MMMM.simulate_tfh_checks(goal, pool, total, cpm), cpm)
+        rows.append({
+            'goal': goal,
+            'pool': pool,
+            'total': total,
+            'shuffle_ms': round(shuffle_ms, 3),
+            'vectorized_ms': round(vectorized_ms, 3),
+            'speedup': round(shuffle_ms / vectorized_ms, 1),
+            'shuffle_points': shuffle_points,
+            'vectorized_points': vectorized_points,
+        })
+    return rows
+
+def load_preset(preset:str, argv:list = None) -> tuple:
+    """Parse MMMM.py arguments for a preset and return the prepared weights, default settings and args"""
+    args = MMMM.build_parser().parse_args(['--preset', preset] + (argv or []))
+    MMMM.apply_preset(args)
+    with open(args.i if args.i else "MMMM_weights.json", "r", encoding='utf-8') as f:
+        input_weights = json.load(f)
+    with open(args.d if args.d else "MMMM_base.json", "r", encoding='utf-8') as f:
+        default_settings = json.load(f)
+    MMMM.prepare_weights(input_weights, args, log=lambda *a: None)
+    return input_weights, default_settings, args
+
+def bench_workers(args) -> list:
+    """Time seeded parallel rolls of one preset with 1, 2, 4 and 8 worker processes"""
+    input_weights, default_settings, roll_args = load_preset(args.preset)
+    rows = []
+    reference = None
+    for workers in (1, 2, 4, 8):
+        start = time.perf_counter()
+        roller = MMMM.ParallelRoller(input_weights, default_settings, roll_args, workers)
+        results = [roller.roll(MMMM.derive_seed(args.seed, index)) for index in range(args.repeat)]
+        elapsed = time.perf_counter() - start
+        roller.close()
+        settings = [result['settings'] for result in results]
+        reference = reference or settings
+        rows.append({
+            'preset': args.preset,
+            'workers': workers,
+            'rolls': args.repeat,
+            'attempts': sum(result['attempts'] for result in results),
+            'ms_per_roll': round(elapsed / args.repeat * 1000, 1),
+            'same_as_1_worker': settings == reference,
+        })
+    for row in rows:
+        row['speedup'] = round(rows[0]['ms_per_roll'] / row['ms_per_roll'], 2)
+    return rows
+
+PRESETS = ['friendly', 'notslow', 'complex', 'ordeal', 'chaos', 'volatility']
+
+def bench_prune(args) -> list:
+    """Compare seeded rolls of every preset with and without bound pruning"""
+    rows = []
+    for preset in PRESETS:
+        for prune in (False, True):
+            input_weights, default_settings, roll_args = load_preset(preset, [] if prune else ['--no-prune'])
+            compiled = MMMM.compile_weights(input_weights)
+            start = time.perf_counter()
+            results = [MMMM.roll_with_seed(input_weights, default_settings, roll_args, MMMM.derive_seed(args.seed, index), compiled) for index in range(args.repeat)]
+            elapsed = time.perf_counter() - start
+            attempts = sum(result['attempts'] for result in results)
+            rows.append({
+                'preset': preset,
+                'prune': prune,
+                'rolls': args.repeat,
+                'failures': sum(1 for result in results if not result['settings']),
+                'attempts': attempts,
+                'pruned_attempts': sum(result['pruned'] for result in results),
+                'us_per_attempt': round(elapsed / attempts * 1e6, 1),
+                'ms_per_roll': round(elapsed / args.repeat * 1000, 2),
+            })
+    return rows
+
+# Common --force/--veto combinations rolled for every preset by the suite
+SUITE_OPTIONS = [
+    [],
+    ['--force', 'goal:triforcehunt'],
+    ['--force', 'goal:ganonhunt'],
+    ['--veto', 'goal:triforcehunt,goal:ganonhunt'],
+    ['--force', 'door_shuffle:crossed'],
+    ['--force', 'shuffle:vanilla'],
+    ['--force', 'bow_mode:retro'],
+    ['--multi'],
+]
+
+def bench_suite(args) -> list:
+    """Seeded rolls of every preset and common --force/--veto combination: latency, acceptance and where the time goes"""
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "r", encoding='utf-8') as f:
+            baseline = {(row['preset'], row['options']): row for row in json.load(f)}
+    rows = []
+    for preset in PRESETS:
+        for options in SUITE_OPTIONS:
+            input_weights, default_settings, roll_args = load_preset(preset, options)
+            compiled = MMMM.compile_weights(input_weights)
+            stats = MMMM.RollStats()
+            times = []
+            results = []
+            for index in range(args.repeat):
+                start = time.perf_counter()
+                results.append(MMMM.roll_with_seed(input_weights, default_settings, roll_args, MMMM.derive_seed(args.seed, index), compiled, stats))
+                times.append(time.perf_counter() - start)
+            successes = sum(1 for result in results if result['settings'])
+            row = {
+                'preset': preset,
+                'options': ' '.join(options),
+                'rolls': args.repeat,
+                'failure_rate': round(1 - successes / args.repeat, 3),
+                'attempts_per_success': round(sum(result['attempts'] for result in results) / max(successes, 1), 1),
+                'ms_per_roll': round(sum(times) / args.repeat * 1000, 2),
+                'p95_ms': round(sorted(times)[int(0.95 * (len(times) - 1))] * 1000, 2),
+                'tfh_ms_per_roll': round(stats.phases.get('tfh', 0) / args.repeat * 1000, 2),
+                'inventory_ms_per_roll': round((stats.phases.get('inventory_pass1', 0) + stats.phases.get('inventory_pass2', 0)) / args.repeat * 1000, 2),
+            }
+            previous = baseline.get((preset, row['options']))
+            if previous:
+                row['ms_per_roll_ratio'] = round(row['ms_per_roll'] / previous['ms_per_roll'], 2) if previous['ms_per_roll'] else None
+                row['attempts_ratio'] = round(row['attempts_per_success'] / previous['attempts_per_success'], 2) if previous['attempts_per_success'] else None
+            rows.append(row)
+    return rows
+
+# Runs MMMM.py as __main__ in a fresh interpreter and reports whether the roll imported numpy
+STARTUP_PROBE = '''
+import runpy, sys
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+finally:
+    sys.stderr.write('numpy imported: %s\\n' % ('numpy' in sys.modules))
+'''
+STARTUP_OPTIONS = [
+    ['--veto', 'goal:triforcehunt,goal:ganonhunt'],
+    ['--force', 'goal:triforcehunt'],
+    ['--force', 'goal:triforcehunt', '--tfh', 'simulate'],
+]
+
+def bench_startup(args) -> list:
+    """Time-to-first-result of a cold MMMM.py process per preset, without and with triforce hunt goals"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'MMMM.py')
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'mystery.json')
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', 'pass'], check=True)
+            times.append(time.perf_counter() - start)
+        rows.append({'preset': '', 'options': 'python -c pass', 'runs': args.repeat, 'median_ms': round(statistics.median(times) * 1000, 1),
+                     'min_ms': round(min(times) * 1000, 1), 'numpy_imported': False})
+        for preset in PRESETS:
+            for options in STARTUP_OPTIONS:
+                times = []
+                for index in range(args.repeat):
+                    command = [sys.executable, '-c', STARTUP_PROBE, script, '--preset', preset, '--seed', str(args.seed + index), '-o', output] + options
+                    start = time.perf_counter()
+                    process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+                    times.append(time.perf_counter() - start)
+                rows.append({
+                    'preset': preset,
+                    'options': ' '.join(options),
+                    'runs': args.repeat,
+                    'median_ms': round(statistics.median(times) * 1000, 1),
+                    'min_ms': round(min(times) * 1000, 1),
+                    'numpy_imported': 'numpy imported: True' in process.stderr,
+                })
+    return rows
+
+def marginals(results:list) -> dict:
+    """Relative frequency of each value of each setting over the successful rolls"""
+    counts = {}
+    rolls = [result['settings'] for result in results if result['settings']]
+    for settings in rolls:
+        for setting_name, value in settings.items():
+            setting_counts = counts.setdefault(setting_name, {})
+            setting_counts[str(value)] = setting_counts.get(str(value), 0) + 1
+    return {setting_name: {value: count / len(rolls) for value, count in setting_counts.items()} for setting_name, setting_counts in counts.items()}
+
+def total_variation(first:dict, second:dict) -> float:
+    """Total variation distance between two discrete distributions"""
+    return sum(abs(first.get(value, 0) - second.get(value, 0)) for value in set(first) | set(second)) / 2
+
+def bench_repair(args) -> list:
+    """Compare attempts per success and the setting distributions of seeded rolls with and without --repair"""
+    rows = []
+    for preset in PRESETS:
+        distributions = []
+        for repair in (False, True):
+            input_weights, default_settings, roll_args = load_preset(preset, ['--repair'] if repair else [])
+            compiled = MMMM.compile_weights(input_weights)
+            start = time.perf_counter()
+            results = [MMMM.roll_with_seed(input_weights, default_settings, roll_args, MMMM.derive_seed(args.seed, index), compiled) for index in range(args.repeat)]
+            elapsed = time.perf_counter() - start
+            successes = sum(1 for result in results if result['settings'])
+            distributions.append(marginals(results))
+            rows.append({
+                'preset': preset,
+                'repair': repair,
+                'rolls': args.repeat,
+                'failures': args.repeat - successes,
+                'attempts_per_success': round(sum(result['attempts'] for result in results) / max(successes, 1), 1),
+                'repaired': sum(1 for result in results if result.get('repaired')),
+                'ms_per_roll': round(elapsed / args.repeat * 1000, 2),
+            })
+        distances = {setting_name: total_variation(distributions[0][setting_name], distributions[1].get(setting_name, {}))
+                     for setting_name in distributions[0] if setting_name in MMMM.REPAIRABLE}
+        worst = max(distances, key=distances.get)
+        rows[-1]['worst_setting'] = rows[-2]['worst_setting'] = worst
+        rows[-1]['worst_tvd'] = rows[-2]['worst_tvd'] = round(distances[worst], 3)
+    return rows
+
+def seeded_rolls(preset:str, argv:list, seed:int, repeat:int) -> tuple:
+    """Roll a preset repeat times from derived seeds, returning the results and the elapsed seconds"""
+    input_weights, default_settings, roll_args = load_preset(preset, argv)
+    compiled = MMMM.compile_weights(input_weights)
+    if roll_args.engine == 'batch':
+        MMMM.batch_engine(compiled, default_settings, roll_args)
+    start = time.perf_counter()
+    results = [MMMM.roll_with_seed(input_weights, default_settings, roll_args, MMMM.derive_seed(seed, index), compiled) for index in range(repeat)]
+    return results, time.perf_counter() - start
+
+def worst_distance(first:list, second:list) -> tuple:
+    """The setting (or score attribute) whose distribution differs most between two sets of results, and by how much"""
+    first_marginals = marginals(first)
+    second_marginals = marginals(second)
+    for results, distributions in ((first, first_marginals), (second, second_marginals)):
+        for attr in MMMM.ATTRIBUTES:
+            distributions['score:' + attr] = marginals([{'settings': {attr: result['score'][attr]}} for result in results if result['settings']])[attr]
+    distances = {setting_name: total_variation(first_marginals[setting_name], second_marginals.get(setting_name, {})) for setting_name in first_marginals}
+    worst = max(distances, key=distances.get)
+    return worst, round(distances[worst], 3)
+
+def bench_inventory(args) -> list:
+    """Compare the greedy start inventory passes with the subset solver: attempts per success, time and items handed out"""
+    rows = []
+    for preset in PRESETS:
+        for options in ([], ['--force', 'goal:triforcehunt']):
+            for inventory in ('greedy', 'solver'):
+                results, seconds = seeded_rolls(preset, options + ['--inventory', inventory], args.seed, args.repeat)
+                successes = [result for result in results if result['settings']]
+                rows.append({
+                    'preset': preset,
+                    'options': ' '.join(options),
+                    'inventory': inventory,
+                    'rolls': args.repeat,
+                    'failures': args.repeat - len(successes),
+                    'attempts_per_success': round(sum(result['attempts'] for result in results) / max(len(successes), 1), 1),
+                    'ms_per_roll': round(seconds / args.repeat * 1000, 2),
+                    'mean_start_items': round(statistics.mean(len(result['settings']['startinventory'].split(',')) if 'startinventory' in result['settings'] else 0
+                                                        for result in successes), 2) if successes else None,
+                    'attempts_saved': None,
+                })
+            rows[-1]['attempts_saved'] = round(1 - rows[-1]['attempts_per_success'] / rows[-2]['attempts_per_success'], 3)
+    return rows
+
+def bench_batch(args) -> list:
+    """Compare the batch engine with scalar attempts: attempts per second, time per roll and distributions.
+
+    Seeded rolls screen batches within their chunks, unseeded rolls of a --count batch share one BatchHeads,
+    which is where large batches pay off. The batch engine and its pilot screen are built before the clock starts,
+    like the compiled weights, as a server builds them once per variant. Presets whose pilot lets more than
+    BATCH_SURVIVAL of the attempts through roll scalar attempts either way. noise is the distance between two
+    scalar runs with different seeds.
+    """
+    rows = []
+    for preset in PRESETS:
+        for options in ([], ['--force', 'goal:triforcehunt']):
+            reference, reference_seconds = seeded_rolls(preset, options, args.seed, args.repeat)
+            rerun, _ = seeded_rolls(preset, options, args.seed + 1, args.repeat)
+            batch, batch_seconds = seeded_rolls(preset, options + ['--engine', 'batch'], args.seed, args.repeat)
+            input_weights, default_settings, roll_args = load_preset(preset, options + ['--engine', 'batch'])
+            compiled = MMMM.compile_weights(input_weights)
+            MMMM.batch_engine(compiled, default_settings, roll_args)
+            batch_heads = MMMM.BatchHeads()
+            MMMM.seed_rngs(args.seed)
+            start = time.perf_counter()
+            unseeded = [MMMM.roll_mystery(input_weights, default_settings, roll_args, compiled, batch_heads=batch_heads) for _ in range(args.repeat)]
+            unseeded_seconds = time.perf_counter() - start
+            scalar_attempts = sum(result['attempts'] for result in reference)
+            batch_attempts = sum(result['attempts'] for result in batch)
+            worst_setting, worst_tvd = worst_distance(reference, batch)
+            noise_setting, noise_tvd = worst_distance(reference, rerun)
+            rows.append({
+                'preset': preset,
+                'options': ' '.join(options),
+                'rolls': args.repeat,
+                'attempts_scalar': round(scalar_attempts / args.repeat, 1),
+                'attempts_batch': round(batch_attempts / args.repeat, 1),
+                'attempts_per_s_scalar': round(scalar_attempts / reference_seconds),
+                'attempts_per_s_batch': round(batch_attempts / batch_seconds),
+                'attempts_per_s_unseeded': round(sum(result['attempts'] for result in unseeded) / unseeded_seconds),
+                'ms_scalar': round(reference_seconds / args.repeat * 1000, 2),
+                'ms_batch': round(batch_seconds / args.repeat * 1000, 2),
+                'ms_unseeded': round(unseeded_seconds / args.repeat * 1000, 2),
+                'failures_batch': sum(1 for result in batch if not result['settings']),
+                'worst': worst_setting,
+                'worst_tvd': worst_tvd,
+                'noise_tvd': noise_tvd,
+            })
+    return rows
+
+def bench_multiworld(args) -> list:
+    """Time a multiworld of repeat worlds of one preset with 1, 2, 4 and 8 worker processes, with and without constraints"""
+    rows = []
+    for options in ([], ['--length-spread', '2', '--shared-goal']):
+        input_weights, default_settings, roll_args = load_preset(args.preset, ['--players', str(args.repeat)] + options)
+        reference = None
+        for workers in (1, 2, 4, 8):
+            start = time.perf_counter()
+            multiworld = MMMM.roll_multiworld(input_weights, default_settings, roll_args, args.repeat, args.seed, workers)
+            elapsed = time.perf_counter() - start
+            settings = [result['settings'] for result in multiworld['players']]
+            reference = reference or settings
+            rows.append({
+                'options': ' '.join(options),
+                'players': args.repeat,
+                'workers': workers,
+                'seconds': round(elapsed, 2),
+                'ms_per_world': round(elapsed / args.repeat * 1000, 1),
+                'complete': multiworld['complete'],
+                'length_spread': multiworld['length_spread'],
+                'same_as_1_worker': settings == reference,
+            })
+    return rows
+
+def bench_yaml(args) -> list:
+    """Mysteries per second converted to yaml: one MMMM_json2yaml.py process per file, a whole directory, and a json lines stream.
+
+    Converts repeat * 100 rolled mysteries in process, and repeat of them with a process each.
+    """
+    import yaml
+    import MMMM_json2yaml
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'MMMM_json2yaml.py')
+    results, _ = seeded_rolls('friendly', [], args.seed, args.repeat)
+    mysteries = [result['settings'] for result in results if result['settings']]
+    count = args.repeat * 100
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        input_dir = os.path.join(directory, 'json')
+        os.makedirs(input_dir)
+        for index in range(count):
+            with open(os.path.join(input_dir, f'{index:06}.json'), "w", encoding='utf-8') as f:
+                f.write(json.dumps(mysteries[index % len(mysteries)], indent=4))
+        lines = [json.dumps({'index': index, 'settings': mysteries[index % len(mysteries)]}) + '\n' for index in range(count)]
+
+        def row(method:str, files:int, seconds:float) -> dict:
+            return {'method': method, 'mysteries': files, 'seconds': round(seconds, 3), 'per_second': round(files / seconds, 1)}
+
+        start = time.perf_counter()
+        for index in range(args.repeat):
+            subprocess.run([sys.executable, script, '-i', os.path.join(input_dir, f'{index:06}.json'), '-o', os.path.join(directory, 'process.yaml')], check=True)
+        rows.append(row('process per file', args.repeat, time.perf_counter() - start))
+
+        for dumper in (yaml.SafeDumper, MMMM_json2yaml.Dumper):
+            MMMM_json2yaml.Dumper, default_dumper = dumper, MMMM_json2yaml.Dumper
+            try:
+                start = time.perf_counter()
+                MMMM_json2yaml.convert_directory(input_dir, os.path.join(directory, dumper.__name__))
+                rows.append(row(f'directory ({dumper.__name__})', count, time.perf_counter() - start))
+                start = time.perf_counter()
+                with open(os.path.join(directory, 'stream.yaml'), "w", encoding='utf-8') as f:
+                    MMMM_json2yaml.convert_lines(lines, f)
+                rows.append(row(f'json lines ({dumper.__name__})', count, time.perf_counter() - start))
+            finally:
+                MMMM_json2yaml.Dumper = default_dumper
+    return rows
+
+def print_rows(rows:list) -> None:
+    columns = list(rows[0].keys())
+    print('\t'.join(columns))
+    for row in rows:
+        print('\t'.join(str(row[column]) for column in columns))
+
+def main():
+    parser = argparse.ArgumentParser(add_help=True)
+    parser.add_argument('benchmark', choices=['tfh', 'workers', 'prune', 'repair', 'suite', 'startup', 'inventory', 'yaml', 'batch', 'multiworld'], help='Which benchmark to run')
+    parser.add_argument('-o', help='Write the results as json to this path')
+    parser.add_argument('--repeat', help='Calls or rolls per measurement', type=int, default=20)
+    parser.add_argument('--seed', help='Master seed for the benchmark', type=int, default=0)
+    parser.add_argument('--preset', help='Preset to roll', default='ordeal')
+    parser.add_argument('--baseline', help='Earlier suite report to compare against')
+    args = parser.parse_args()
+
+    benchmarks = {
+        'tfh': bench_tfh,
+        'workers': bench_workers,
+        'prune': bench_prune,
+        'repair': bench_repair,
+        'suite': bench_suite,
+        'startup': bench_startup,
+        'inventory': bench_inventory,
+        'yaml': bench_yaml,
+        'batch': bench_batch,
+        'multiworld': bench_multiworld,
+    }
+    rows = benchmarks[args.benchmark](args)
+    print_rows(rows)
+
+    if args.o:
+        with open(args.o, "w+", encoding='utf-8') as f:
+            f.write(json.dumps(rows, indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import os
+import time
+
+import MMMM
+
+def build_variants(weight_file:str, directory:str, argv:list) -> list:
+    """Build the compiled weights of every preset with the given --force/--veto/--multi arguments, with and without --multi"""
+    rows = []
+    for preset in MMMM.PRESETS:
+        for multi in ([[]] if '--multi' in argv else [[], ['--multi']]):
+            args = MMMM.build_parser().parse_args(['--preset', preset] + argv + multi)
+            MMMM.apply_preset(args)
+            path = MMMM.variant_path(directory, args)
+            if os.path.exists(path):
+                os.remove(path)
+            start = time.perf_counter()
+            MMMM.load_compiled(weight_file, args, directory, log=lambda *a: None)
+            rows.append((path, os.path.getsize(path), (time.perf_counter() - start) * 1000))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(add_help=True)
+    parser.add_argument('command', choices=['build'], help='Build the compiled weights of every preset')
+    parser.add_argument('-i', help='Path to the points weights file to use for rolling game settings')
+    parser.add_argument('--dir', help='Directory to write the compiled weights to', default=MMMM.COMPILED_DIR)
+    parser.add_argument('--force', help='setting1:option,setting2:option')
+    parser.add_argument('--veto', help='setting1:option,setting2:option')
+    parser.add_argument('--multi', help='Only build the --multi variants', action='store_true')
+    args = parser.parse_args()
+
+    argv = []
+    if args.force:
+        argv += ['--force', args.force]
+    if args.veto:
+        argv += ['--veto', args.veto]
+    if args.multi:
+        argv.append('--multi')
+    weight_file = args.i if args.i else "MMMM_weights.json"
+    for path, size, ms in build_variants(weight_file, args.dir, argv):
+        print(f'Wrote {path} ({size} bytes, {ms:.1f} ms)')
+
+if __name__ == '__main__':
+    main()
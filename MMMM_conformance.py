@@ -0,0 +1,188 @@
+import json
+import argparse
+import math
+import os
+import random
+import shlex
+import sys
+import time
+
+import MMMM
+import MMMM_analyze
+
+# The reference roller: rejection sampling through the whole rule chain, simulated triforce hunts, the greedy
+# start inventory and no pruning, i.e. the code every faster engine has to stay distributed like
+REFERENCE_ARGS = ['--tfh', 'simulate', '--no-prune', '--inventory', 'greedy', '--engine', 'scalar']
+# Settings compared jointly: the crystals for GT follow the goal, the entrance shuffle and the crystals for ganon
+PAIRS = ['goal', 'shuffle', 'crystals_ganon', 'crystals_gt']
+MIN_EXPECTED = 5
+
+def chi2_sf(statistic:float, dof:int) -> float:
+    """P(X >= statistic) for a chi-square distribution, the regularized upper incomplete gamma Q(dof/2, statistic/2).
+
+    A series gives the lower function below a + 1 and a continued fraction (modified Lentz) the upper one above it.
+    """
+    a = dof / 2
+    x = statistic / 2
+    if x <= 0:
+        return 1.0
+    log_prefix = a * math.log(x) - x - math.lgamma(a)
+    if x < a + 1:
+        term = total = 1 / a
+        n = a
+        for _ in range(10000):
+            n += 1
+            term *= x / n
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return min(1.0, max(0.0, 1 - total * math.exp(log_prefix)))
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 10000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return min(1.0, math.exp(log_prefix) * h)
+
+def chi2_homogeneity(first:dict, second:dict, first_total:int, second_total:int):
+    """Chi-square test that two samples of counts per category come from the same distribution.
+
+    Categories missing from a count dict but making up its total are counted as absent. Categories expected fewer
+    than MIN_EXPECTED times in either sample are pooled. Returns (statistic, dof, p), or None with fewer than two bins.
+    """
+    first = dict(first)
+    second = dict(second)
+    first['(absent)'] = first_total - sum(first.values())
+    second['(absent)'] = second_total - sum(second.values())
+    total = first_total + second_total
+    if not first_total or not second_total:
+        return None
+    bins = []
+    pooled = [0, 0]
+    for category in set(first) | set(second):
+        counts = (first.get(category, 0), second.get(category, 0))
+        if not sum(counts):
+            continue
+        if min(sum(counts) * first_total, sum(counts) * second_total) / total < MIN_EXPECTED:
+            pooled[0] += counts[0]
+            pooled[1] += counts[1]
+        else:
+            bins.append(counts)
+    if sum(pooled):
+        bins.append(tuple(pooled))
+    if len(bins) < 2:
+        return None
+    statistic = 0.0
+    for counts in bins:
+        row = sum(counts)
+        for count, sample_total in zip(counts, (first_total, second_total)):
+            expected = row * sample_total / total
+            statistic += (count - expected) ** 2 / expected
+    dof = len(bins) - 1
+    return statistic, dof, chi2_sf(statistic, dof)
+
+def two_proportion(first_hits:int, first_total:int, second_hits:int, second_total:int):
+    """Two-sided two-proportion z-test, returns (z, p), or None when either sample is empty or the rates are 0 or 1"""
+    if not first_total or not second_total:
+        return None
+    rate = (first_hits + second_hits) / (first_total + second_total)
+    if rate in (0, 1):
+        return None
+    z = (first_hits / first_total - second_hits / second_total) / math.sqrt(rate * (1 - rate) * (1 / first_total + 1 / second_total))
+    return z, math.erfc(abs(z) / math.sqrt(2))
+
+def compare(reference:dict, candidate:dict, acceptance:bool = True) -> list:
+    """Every test between two Tally.to_dict() outputs: acceptance, setting marginals, pairs, scores and start items"""
+    tests = []
+
+    def add(kind:str, name:str, outcome) -> None:
+        if outcome is not None:
+            statistic, *dof, p = outcome
+            tests.append({'kind': kind, 'name': name, 'statistic': round(statistic, 3), 'dof': dof[0] if dof else None, 'p': p})
+
+    if acceptance:
+        add('acceptance', 'accepted/attempts', two_proportion(reference['accepted'], reference['attempts'], candidate['accepted'], candidate['attempts']))
+    accepted = (reference['accepted'], candidate['accepted'])
+    for kind in ('settings', 'joint', 'scores'):
+        for name in sorted(set(reference[kind]) | set(candidate[kind])):
+            add(kind, name, chi2_homogeneity(reference[kind].get(name, {}), candidate[kind].get(name, {}), *accepted))
+    for item in sorted(set(reference['start_items']) | set(candidate['start_items'])):
+        add('start_items', item, chi2_homogeneity({'held': reference['start_items'].get(item, 0)}, {'held': candidate['start_items'].get(item, 0)}, *accepted))
+    return tests
+
+def tally(input_weights:dict, default_settings:dict, argv:list, rolls:int, seed:int, workers:int) -> dict:
+    """Roll and tally a preset with MMMM.py arguments argv"""
+    args = MMMM.build_parser().parse_args(argv)
+    MMMM.apply_preset(args)
+    MMMM.prepare_weights(input_weights, args, log=lambda *a: None)
+    return MMMM_analyze.analyze(input_weights, default_settings, args, rolls, seed, workers, PAIRS).to_dict()
+
+def main():
+    parser = argparse.ArgumentParser(add_help=True, description='Compare the settings, scores and acceptance of alternative engines with the reference roller')
+    parser.add_argument('--presets', help='Comma separated presets to compare', default=','.join(preset for preset in MMMM.PRESETS if preset != 'custom'))
+    parser.add_argument('--candidate', help='MMMM.py arguments of an engine to check, added to the reference ones (repeatable), e.g. --candidate="--engine batch"',
+                        action='append', default=[])
+    parser.add_argument('--rolls', help='Mysteries to roll per preset and engine', type=int, default=20000)
+    parser.add_argument('--alpha', help='Family-wise significance level, split over every test (Bonferroni)', type=float, default=0.001)
+    parser.add_argument('--no-acceptance', help='Skip the acceptance rate test, for candidates that change the attempts by design', action='store_true')
+    parser.add_argument('--workers', help='Worker processes (default: every cpu)', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', help='Master seed of the rolls', type=int)
+    parser.add_argument('-i', help='Path to the points weights file to use for rolling game settings')
+    parser.add_argument('-d', help='Path to the base settings file')
+    parser.add_argument('-o', help='Write the report to this path instead of stdout')
+    args = parser.parse_args()
+
+    with open(args.i if args.i else "MMMM_weights.json", "r", encoding='utf-8') as f:
+        weights = json.load(f)
+    with open(args.d if args.d else "MMMM_base.json", "r", encoding='utf-8') as f:
+        default_settings = json.load(f)
+    seed = args.seed if args.seed is not None else random.getrandbits(63)
+    candidates = args.candidate or ['']
+
+    comparisons = []
+    for preset in args.presets.split(','):
+        start = time.perf_counter()
+        reference = tally(json.loads(json.dumps(weights)), default_settings, ['--preset', preset] + REFERENCE_ARGS, args.rolls, seed, args.workers)
+        print(f'{preset}: reference rolled in {time.perf_counter() - start:.1f} s', file=sys.stderr)
+        for index, candidate in enumerate(candidates):
+            start = time.perf_counter()
+            rolled = tally(json.loads(json.dumps(weights)), default_settings, ['--preset', preset] + REFERENCE_ARGS + shlex.split(candidate),
+                           args.rolls, MMMM.derive_seed(seed, 'candidate', index), args.workers)
+            print(f'{preset}: {candidate or "reference rerun"} rolled in {time.perf_counter() - start:.1f} s', file=sys.stderr)
+            comparisons.append({'preset': preset, 'candidate': candidate, 'tests': compare(reference, rolled, not args.no_acceptance),
+                                'acceptance': {'reference': round(reference['accepted'] / reference['attempts'], 4),
+                                               'candidate': round(rolled['accepted'] / rolled['attempts'], 4)}})
+
+    tests = sum(len(comparison['tests']) for comparison in comparisons)
+    threshold = args.alpha / max(tests, 1)
+    failures = 0
+    for comparison in comparisons:
+        comparison['drift'] = [test for test in comparison['tests'] if test['p'] < threshold]
+        comparison['tests'] = len(comparison['tests'])
+        failures += len(comparison['drift'])
+        for test in comparison['drift']:
+            print(f'DRIFT {comparison["preset"]} {comparison["candidate"] or "reference rerun"}: {test["kind"]} {test["name"]} p={test["p"]:.3g}', file=sys.stderr)
+    report = {'seed': seed, 'rolls': args.rolls, 'alpha': args.alpha, 'tests': tests, 'threshold': threshold, 'failures': failures, 'comparisons': comparisons}
+    if args.o:
+        with open(args.o, "w+", encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+    print(f'{tests} tests, {failures} significant at {args.alpha} family-wise', file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
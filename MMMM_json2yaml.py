@@ -1,59 +1,59 @@
 import yaml
 import json
 import argparse
+import os
+import sys
 
-def main():
-    input_json_file = 'MMMM_mystery.json'
-    ouput_yaml_file = 'MMMM_mystery.yaml'
-    with open(input_json_file, "r", encoding='utf-8') as f:
-        input_json = json.load(f)
+IGNORE = [
+    'enemizercli',
+    'saveonexit',
+    'calc_playthrough',
+    'create_spoiler',
+    'mystery',
+    'bps',
+    'collection_rate',
+]
 
-    mystery = {
-        'description': 'Mystery'
+SETTING_MAP = {
+    'goal': 'goals',
+    'bigkeyshuffle': 'bigkey_shuffle',
+    'keyshuffle': 'smallkey_shuffle',
+    'compassshuffle': 'compass_shuffle',
+    'mapshuffle': 'map_shuffle',
+    'swords': 'weapons',
+    'crystals_ganon': 'ganon_open',
+    'crystals_gt': 'tower_open',
+    'mode': 'world_state',
+    'shuffle': 'entrance_shuffle',
+    "shuffleenemies": 'enemy_shuffle',
+    "shufflebosses": 'boss_shuffle',
+    'logic': 'glitches_required',
+    'difficulty': 'item_pool'
+}
+OPTION_MAP = {
+    'goals': {
+        'crystals': 'fast_ganon',
+        'triforcehunt': 'triforce-hunt'
+    },
+    'weapons': {
+        'random': 'randomized'
+    },
+    'glitches_required': {
+        'noglitches': 'none',
+        'owglitches': 'owg',
+        'no_logic': 'nologic'
     }
-    
-    IGNORE = [
-        'enemizercli',
-        'saveonexit',
-        'calc_playthrough',
-        'create_spoiler',
-        'mystery',
-        'bps',
-        'collection_rate',
-    ]
+}
 
-    SETTING_MAP = {
-        'goal': 'goals',
-        'bigkeyshuffle': 'bigkey_shuffle',
-        'keyshuffle': 'smallkey_shuffle',
-        'compassshuffle': 'compass_shuffle',
-        'mapshuffle': 'map_shuffle',
-        'swords': 'weapons',
-        'crystals_ganon': 'ganon_open',
-        'crystals_gt': 'tower_open',
-        'mode': 'world_state',
-        'shuffle': 'entrance_shuffle',
-        "shuffleenemies": 'enemy_shuffle',
-        "shufflebosses": 'boss_shuffle',
-        'logic': 'glitches_required',
-        'difficulty': 'item_pool'
-    }
-    OPTION_MAP = {
-        'goals': {
-            'crystals': 'fast_ganon',
-            'triforcehunt': 'triforce-hunt'
-        },
-        'weapons': {
-            'random': 'randomized'
-        },
-        'glitches_required': {
-            'noglitches': 'none',
-            'owglitches': 'owg',
-            'no_logic': 'nologic'
-        }
-    }
+# libyaml's dumper when pyyaml was built with it, it writes the same documents several times faster
+Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
 
-    for setting,option in input_json.items():
+def convert(settings:dict) -> dict:
+    """Convert rolled MMMM.py settings to a mystery yaml document"""
+    mystery = {
+        'description': 'Mystery'
+    }
+    for setting,option in settings.items():
         if setting in IGNORE:
             continue
         if setting == 'startinventory':
@@ -67,9 +67,69 @@ def main():
                 option = 'on' if option == 1 else 'off'
             option = OPTION_MAP[setting][option] if setting in OPTION_MAP and option in OPTION_MAP[setting] else option
             mystery[setting] = option
+    return mystery
+
+def dump(mystery:dict, stream=None, explicit_start:bool = False):
+    """Write a mystery document to a text stream, or return it as a string without one"""
+    return yaml.dump(mystery, stream, Dumper=Dumper, allow_unicode=True, default_flow_style=False, explicit_start=explicit_start)
+
+def convert_file(input_file:str, output_file:str) -> None:
+    with open(input_file, "r", encoding='utf-8') as f:
+        settings = json.load(f)
+    with open(output_file, "w+", encoding='utf-8') as f:
+        dump(convert(settings), f)
+
+def convert_directory(input_dir:str, output_dir:str) -> int:
+    """Convert every .json mystery in a directory to a .yaml file of the same name, returning how many were written"""
+    os.makedirs(output_dir, exist_ok=True)
+    converted = 0
+    for entry in sorted(os.scandir(input_dir), key=lambda entry: entry.name):
+        if entry.is_file() and entry.name.endswith('.json'):
+            convert_file(entry.path, os.path.join(output_dir, entry.name[:-len('.json')] + '.yaml'))
+            converted += 1
+    return converted
+
+def convert_lines(lines, output) -> int:
+    """Convert a json lines stream of mysteries to one yaml stream with a document per mystery.
+
+    Lines are either plain settings or MMMM.py --count lines, whose failed rolls (without settings) are skipped.
+    Returns how many documents were written.
+    """
+    converted = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        settings = json.loads(line)
+        if 'index' in settings:
+            settings = settings.get('settings')
+            if not settings:
+                continue
+        dump(convert(settings), output, explicit_start=True)
+        converted += 1
+    return converted
+
+def main():
+    parser = argparse.ArgumentParser(add_help=True)
+    parser.add_argument('-i', help='A mystery json file, a directory of them, or a .jsonl stream of them (- for stdin)', default='MMMM_mystery.json')
+    parser.add_argument('-o', help='Output yaml file, directory (default: the input directory) or yaml stream (default: stdout)')
+    args = parser.parse_args()
 
-    with open(ouput_yaml_file, "w+", encoding='utf-8') as f:
-        yaml.dump(mystery,f, Dumper=yaml.SafeDumper, encoding='utf-8', allow_unicode=True, default_flow_style=False)
+    if os.path.isdir(args.i):
+        converted = convert_directory(args.i, args.o if args.o else args.i)
+        print(f'Converted {converted} mysteries', file=sys.stderr)
+    elif args.i == '-' or args.i.endswith('.jsonl'):
+        lines = sys.stdin if args.i == '-' else open(args.i, "r", encoding='utf-8')
+        output = open(args.o, "w+", encoding='utf-8') if args.o else sys.stdout
+        try:
+            converted = convert_lines(lines, output)
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+            if output is not sys.stdout:
+                output.close()
+        print(f'Converted {converted} mysteries', file=sys.stderr)
+    else:
+        convert_file(args.i, args.o if args.o else 'MMMM_mystery.yaml')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,43 @@
+import json
+import argparse
+import time
+
+import MMMM
+import MMMM_server
+
+def main():
+    parser = argparse.ArgumentParser(add_help=True)
+    parser.add_argument('command', choices=['fill', 'status'], help='Roll the reservoir full, or show how many mysteries it holds per preset')
+    parser.add_argument('-i', help='Path to the points weights file to use for rolling game settings')
+    parser.add_argument('-d', help='Path to the base settings file')
+    parser.add_argument('--dir', help='Directory of the reservoir', default=MMMM.RESERVOIR_DIR)
+    parser.add_argument('--size', help='Mysteries to keep per preset', type=int, default=10)
+    parser.add_argument('--presets', help='Comma separated presets to fill (default: all)')
+    parser.add_argument('--workers', help='Worker processes rolling in parallel', type=int, default=2)
+    args = parser.parse_args()
+
+    weight_file = args.i if args.i else "MMMM_weights.json"
+    default_file = args.d if args.d else "MMMM_base.json"
+    presets = args.presets.split(',') if args.presets else list(MMMM.PRESETS)
+    weights_digest = MMMM.file_digest(weight_file)
+    base_digest = MMMM.file_digest(default_file)
+    reservoir = MMMM.Reservoir(args.dir, weights_digest, base_digest)
+
+    if args.command == 'status':
+        print(json.dumps({preset: reservoir.count(MMMM_server.request_args({'preset': preset})) for preset in presets}, indent=4))
+        return
+
+    with open(weight_file, "r", encoding='utf-8') as f:
+        input_weights = json.load(f)
+    with open(default_file, "r", encoding='utf-8') as f:
+        default_settings = json.load(f)
+    service = MMMM_server.RollService(input_weights, default_settings, weights_digest, base_digest, args.workers, 0, reservoir)
+    start = time.perf_counter()
+    try:
+        stored = service.refill(presets, args.size, parallel=args.workers)
+    finally:
+        service.close()
+    print(f'Stored {stored} mysteries in {args.dir} ({time.perf_counter() - start:.1f} s)')
+
+if __name__ == '__main__':
+    main()
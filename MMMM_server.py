@@ -0,0 +1,328 @@
+import json
+import argparse
+import copy
+import os
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import MMMM
+
+# Request fields that map onto MMMM.py arguments, and the largest request body accepted
+LIMIT_FIELDS = ('min_length', 'max_length', 'min_execution', 'max_execution', 'min_familiarity', 'max_familiarity',
+                'min_variance', 'max_variance', 'min_items', 'max_items')
+REQUEST_FIELDS = ('preset', 'force', 'veto', 'multi', 'seed', 'tfh', 'prune', 'repair', 'time_budget_ms', 'best_effort') + LIMIT_FIELDS
+MAX_BODY = 64 * 1024
+MAX_VARIANTS = 32
+
+class RequestError(ValueError):
+    """A roll request the service cannot parse, answered with 400"""
+
+def request_args(request:dict):
+    """Turn a json roll request into MMMM.py arguments, with the preset limits filled in and a seed always set"""
+    if not isinstance(request, dict):
+        raise RequestError('Expected a json object')
+    unknown = sorted(set(request) - set(REQUEST_FIELDS))
+    if unknown:
+        raise RequestError(f'Unknown fields: {", ".join(unknown)}')
+    argv = []
+    for field in ('preset', 'tfh') + LIMIT_FIELDS:
+        if request.get(field) is not None:
+            argv += [f'--{field}', str(request[field])]
+    for field in ('force', 'veto'):
+        value = request.get(field)
+        if isinstance(value, dict):
+            value = ','.join(f'{setting}:{option}' for setting, option in value.items())
+        elif isinstance(value, list):
+            value = ','.join(value)
+        if value:
+            argv += [f'--{field}', str(value)]
+    if request.get('multi'):
+        argv.append('--multi')
+    if request.get('repair'):
+        argv.append('--repair')
+    if request.get('time_budget_ms') is not None:
+        argv += ['--time-budget-ms', str(request['time_budget_ms'])]
+    if request.get('best_effort'):
+        argv.append('--best-effort')
+    if request.get('prune') is False:
+        argv.append('--no-prune')
+    try:
+        args = MMMM.build_parser().parse_args(argv)
+    except SystemExit:
+        raise RequestError('Invalid request: ' + ' '.join(argv))
+    MMMM.apply_preset(args)
+    seed = request.get('seed')
+    if seed is not None and (not isinstance(seed, int) or isinstance(seed, bool) or seed < 0):
+        raise RequestError('seed must be a non-negative integer')
+    args.seed = seed if seed is not None else random.getrandbits(63)
+    args.unseeded = seed is None
+    return args
+
+# Worker process state: the raw inputs and the compiled weights per preset/force/veto/multi variant
+_service = {}
+
+def _init_service(input_weights:dict, default_settings:dict) -> None:
+    _service['input_weights'] = input_weights
+    _service['default_settings'] = default_settings
+    _service['variants'] = OrderedDict()
+    for preset in MMMM.PRESETS:
+        _variant(request_args({'preset': preset}))
+
+def _variant(args) -> tuple:
+    """The prepared and compiled weights of a preset/force/veto/multi combination, compiled once per worker"""
+    key = (args.preset, args.force, args.veto, args.multi)
+    variants = _service['variants']
+    if key in variants:
+        variants.move_to_end(key)
+    else:
+        input_weights = copy.deepcopy(_service['input_weights'])
+        MMMM.prepare_weights(input_weights, args, log=lambda *a: None)
+        variants[key] = (input_weights, MMMM.compile_weights(input_weights))
+        if len(variants) > MAX_VARIANTS:
+            variants.popitem(last=False)
+    return variants[key]
+
+def _serve_roll(args, deadline:float = None) -> tuple:
+    """Roll a request, returning the result along with the worker's pid and TFH cache counters"""
+    input_weights, compiled = _variant(args)
+    result = MMMM.roll_with_seed(input_weights, _service['default_settings'], args, args.seed, compiled, deadline=deadline)
+    return result, os.getpid(), MMMM.tfh_cache.to_dict()
+
+class RollService:
+    """Rolls requests on a bounded pool of worker processes, each holding the preprocessed weights.
+
+    With a reservoir, unseeded requests are served from its pre-rolled mysteries when it has one of their variant.
+    """
+    def __init__(self, input_weights:dict, default_settings:dict, weights_digest:str, base_digest:str, workers:int, queue:int, reservoir:MMMM.Reservoir = None):
+        self.executor = ProcessPoolExecutor(workers, initializer=_init_service, initargs=(input_weights, default_settings))
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(workers + queue)
+        self.digests = (weights_digest, base_digest)
+        self.cache = MMMM.ResultCache()
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.in_flight = 0
+        self.counters = {'rolled': 0, 'cached': 0, 'reservoir': 0, 'refilled': 0, 'out_of_limits': 0, 'not_found': 0, 'bad_requests': 0, 'rejected': 0, 'errors': 0}
+        self.roll_seconds = 0.0
+        self.tfh_caches = {}
+        self.reservoir = reservoir
+        self.stopping = threading.Event()
+
+    def refill(self, presets:list, size:int, parallel:int = 1) -> int:
+        """Roll the default variant of each preset into the reservoir until it holds size of them, parallel rolls at a time.
+
+        Returns how many mysteries were stored.
+        """
+        wanted = []
+        for preset in presets:
+            wanted += [preset] * max(size - self.reservoir.count(request_args({'preset': preset})), 0)
+        pending = {}
+        stored = 0
+        while wanted or pending:
+            while wanted and len(pending) < parallel and not self.stopping.is_set():
+                args = request_args({'preset': wanted.pop(0)})
+                pending[self.executor.submit(_serve_roll, args)] = args
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                args = pending.pop(future)
+                try:
+                    result, pid, tfh_cache = future.result()
+                except Exception as e:
+                    self.count('errors')
+                    print(f'Refilling the {args.preset} reservoir failed: {e!r}', file=sys.stderr)
+                    continue
+                with self.lock:
+                    self.tfh_caches[pid] = tfh_cache
+                if result['settings']:
+                    self.reservoir.put(args, result)
+                    self.count('refilled')
+                    stored += 1
+        return stored
+
+    def keep_filled(self, presets:list, size:int, interval:float) -> threading.Thread:
+        """Refill the reservoir one roll at a time in a background thread, checking again every interval seconds once it is full"""
+        def run() -> None:
+            while not self.stopping.is_set():
+                try:
+                    stored = self.refill(presets, size)
+                except Exception as e:
+                    self.count('errors')
+                    print(f'Refilling the reservoir failed: {e!r}', file=sys.stderr)
+                    stored = 0
+                if not stored:
+                    self.stopping.wait(interval)
+        thread = threading.Thread(target=run, name='reservoir', daemon=True)
+        thread.start()
+        return thread
+
+    def close(self) -> None:
+        self.stopping.set()
+        self.executor.shutdown(cancel_futures=True)
+
+    def count(self, counter:str) -> None:
+        with self.lock:
+            self.counters[counter] += 1
+
+    def roll(self, request) -> tuple:
+        """Roll one request, returning the http status and the json response"""
+        try:
+            args = request_args(request)
+        except RequestError as e:
+            self.count('bad_requests')
+            return 400, {'error': str(e)}
+        # Only requests that came with a seed can repeat, the fresh seed of an unseeded one would never be asked for again
+        key = MMMM.request_key(*self.digests, args, args.seed) if not args.unseeded else None
+        result = self.reservoir.take(args) if self.reservoir and args.unseeded else None
+        if result is not None:
+            args.seed = result['seed']
+            self.count('reservoir')
+        elif key is not None:
+            result = self.cache.get(key)
+            if result is not None:
+                self.count('cached')
+        if result is None:
+            if not self.slots.acquire(blocking=False):
+                self.count('rejected')
+                return 503, {'error': 'Too many rolls in progress, try again later.'}
+            with self.lock:
+                self.in_flight += 1
+            start = time.perf_counter()
+            try:
+                # The time budget runs from the request, waiting for a worker included
+                result, pid, tfh_cache = self.executor.submit(_serve_roll, args, MMMM.roll_deadline(args)).result()
+            except ValueError as e:
+                self.count('errors')
+                return 400, {'error': str(e), 'seed': args.seed}
+            except Exception as e:
+                # A crashed or broken worker pool, or a request that could not be sent to a worker
+                self.count('errors')
+                return 500, {'error': f'Roll failed: {e!r}', 'seed': args.seed}
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+                    self.roll_seconds += time.perf_counter() - start
+                self.slots.release()
+            with self.lock:
+                self.tfh_caches[pid] = tfh_cache
+            self.count('rolled')
+            if key is not None and result['settings'] and not result.get('out_of_limits'):
+                self.cache.put(key, result)
+        if not result['settings']:
+            self.count('not_found')
+            return 422, {'error': 'No combination found in time.', 'seed': args.seed, 'attempts': result['attempts']}
+        response = {
+            'seed': args.seed,
+            'preset': args.preset,
+            'attempts': result['attempts'],
+            'score': result['score'],
+            'metadata': MMMM.mystery_metadata(result['settings']),
+            'settings': result['settings'],
+        }
+        if result.get('out_of_limits'):
+            self.count('out_of_limits')
+            response['out_of_limits'] = True
+            response['distance'] = result['distance']
+        return 200, response
+
+    def health(self) -> dict:
+        # The reservoir counts its files on disk, which is kept out of the lock
+        reservoir = {preset: self.reservoir.count(request_args({'preset': preset})) for preset in MMMM.PRESETS} if self.reservoir else None
+        with self.lock:
+            rolled = self.counters['rolled']
+            return {
+                'status': 'ok',
+                'uptime_seconds': round(time.time() - self.started, 1),
+                'workers': self.workers,
+                'in_flight': self.in_flight,
+                'counters': dict(self.counters),
+                'mean_roll_ms': round(self.roll_seconds / rolled * 1000, 2) if rolled else None,
+                'cache': {'size': len(self.cache.entries), 'hits': self.cache.hits, 'misses': self.cache.misses},
+                'reservoir': reservoir,
+                'tfh_cache': {counter: sum(tfh_cache[counter] for tfh_cache in self.tfh_caches.values()) for counter in ('size', 'hits', 'misses')},
+            }
+
+class RollHandler(BaseHTTPRequestHandler):
+    """POST /roll with a json request, GET /health for the service status and counters"""
+    server_version = 'MMMM'
+
+    def send_json(self, status:int, payload:dict) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path in ('/health', '/metrics'):
+            self.send_json(200, self.server.service.health())
+        else:
+            self.send_json(404, {'error': 'Not found'})
+
+    def do_POST(self) -> None:
+        if self.path != '/roll':
+            self.send_json(404, {'error': 'Not found'})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            self.send_json(413, {'error': 'Request too large'})
+            return
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self.server.service.count('bad_requests')
+            self.send_json(400, {'error': 'Request body is not valid json'})
+            return
+        self.send_json(*self.server.service.roll(request))
+
+    def log_message(self, format, *args) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+def main():
+    parser = argparse.ArgumentParser(add_help=True)
+    parser.add_argument('-i', help='Path to the points weights file to use for rolling game settings')
+    parser.add_argument('-d', help='Path to the base settings file')
+    parser.add_argument('--host', help='Address to listen on', default='127.0.0.1')
+    parser.add_argument('--port', help='Port to listen on', type=int, default=8080)
+    parser.add_argument('--workers', help='Worker processes rolling requests', type=int, default=2)
+    parser.add_argument('--queue', help='Requests allowed to wait for a free worker before answering 503', type=int, default=8)
+    parser.add_argument('--reservoir', help='Serve unseeded requests from pre-rolled mysteries kept in this directory')
+    parser.add_argument('--reservoir-size', help='Pre-rolled mysteries to keep per preset, refilled in the background', type=int, default=10)
+    parser.add_argument('--verbose', help='Log every request', action='store_true')
+    args = parser.parse_args()
+
+    weight_file = args.i if args.i else "MMMM_weights.json"
+    default_file = args.d if args.d else "MMMM_base.json"
+    with open(weight_file, "r", encoding='utf-8') as f:
+        input_weights = json.load(f)
+    with open(default_file, "r", encoding='utf-8') as f:
+        default_settings = json.load(f)
+
+    weights_digest = MMMM.file_digest(weight_file)
+    base_digest = MMMM.file_digest(default_file)
+    reservoir = MMMM.Reservoir(args.reservoir, weights_digest, base_digest) if args.reservoir else None
+    service = RollService(input_weights, default_settings, weights_digest, base_digest, args.workers, args.queue, reservoir)
+    if reservoir and args.reservoir_size > 0:
+        service.keep_filled(list(MMMM.PRESETS), args.reservoir_size, interval=1.0)
+    server = ThreadingHTTPServer((args.host, args.port), RollHandler)
+    server.service = service
+    server.verbose = args.verbose
+    print(f'Serving rolls on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import json
+import argparse
+import random
+import sys
+from array import array
+import numpy as np
+
+import MMMM
+
+# (shuffled, doors) modifiers stored per entry. Below 300 checks the shuffle changes the pace as well.
+MODIFIERS_SMALL_POOL = [(False, False), (False, True), (True, False), (True, True)]
+MODIFIERS = [(False, False), (False, True)]
+
+def reachable_totals(input_weights:dict) -> list:
+    """Every item pool size determine_pool_size() can return"""
+    totals = set()
+    for pottery in MMMM.POTTERY:
+        for dropshuffle in input_weights['dropshuffle']:
+            for shopsanity in (0, 1):
+                for take_any in input_weights['take_any']:
+                    total = MMMM.NONDUNGEON + MMMM.DUNGEON + MMMM.POTTERY[pottery]
+                    if dropshuffle != 'none':
+                        total += MMMM.KEYDROPS
+                    if shopsanity == 1:
+                        total += MMMM.SHOPSANITY
+                    if take_any != 'none':
+                        total += MMMM.TAKE_ANY
+                    if dropshuffle == 'underworld':
+                        total += MMMM.UNDERWORLD
+                    totals.add(total)
+    return sorted(totals)
+
+def goal_range(input_weights:dict, total:int) -> range:
+    """Every triforce goal triforcehunt() can roll for a pool size, including the +-15% jitter"""
+    base_fraction = total / 216
+    fractions = [int(tf_goalfraction) for tf_goalfraction in input_weights['tfh_goal']]
+    return range(int(min(fractions) * base_fraction * 0.85), int(max(fractions) * base_fraction * 1.15) + 1)
+
+def build_tfh_table(input_weights:dict) -> tuple:
+    """Compute the analytic (length, variance) points for the whole reachable (total, goal, pool, modifier) grid"""
+    deltas = sorted(int(tf_pooldelta) for tf_pooldelta in input_weights['tfh_extra_pool'])
+    table = {
+        'source': MMMM.tfh_table_source(input_weights),
+        'deltas': deltas,
+        'totals': {},
+    }
+    values = array('h')
+    for total in reachable_totals(input_weights):
+        goals = goal_range(input_weights, total)
+        modifiers = MODIFIERS_SMALL_POOL if total < 300 else MODIFIERS
+        table['totals'][str(total)] = [len(values) // 2, goals.start, len(goals), len(modifiers)]
+        for goal in goals:
+            for tf_pooldelta in deltas:
+                pool = int(goal * (1 + tf_pooldelta / 100) + 1)
+                mean_checks, std_checks = MMMM.tfh_checks_exact(goal, pool, total)
+                for shuffled, doors in modifiers:
+                    cpm = MMMM.tfh_checks_per_minute(total, shuffled, doors)
+                    values.extend(MMMM.tfh_points(mean_checks, std_checks, cpm))
+    return table, values
+
+def save_tfh_table(path:str, table:dict, values:array) -> None:
+    """Write the table as a json header line followed by little-endian int16 points"""
+    if sys.byteorder != 'little':
+        values = array('h', values)
+        values.byteswap()
+    with open(path, "wb") as f:
+        f.write(json.dumps(table).encode('utf-8') + b'\n')
+        f.write(values.tobytes())
+
+def check_tfh_table(input_weights:dict, table:dict, samples:int, shuffle:bool) -> dict:
+    """Compare random table entries against the Monte Carlo simulation"""
+    simulate = MMMM.simulate_tfh_checks_shuffle if shuffle else MMMM.simulate_tfh_checks
+    totals = [int(total) for total in table['totals']]
+    report = {'samples': samples, 'exact': 0, 'off_by_one': 0, 'worst': 0, 'mismatches': []}
+    for _ in range(samples):
+        total = random.choice(totals)
+        goal = random.choice(goal_range(input_weights, total))
+        pool = int(goal * (1 + random.choice(table['deltas']) / 100) + 1)
+        shuffled, doors = random.choice(MODIFIERS_SMALL_POOL)
+        cpm = MMMM.tfh_checks_per_minute(total, shuffled, doors)
+        expected = MMMM.tfh_table_lookup(table, goal, pool, total, shuffled, doors)
+        if shuffle:
+            simulated = MMMM.tfh_points(*simulate(goal, pool, total), cpm)
+        else:
+            simulated = MMMM.tfh_points(*simulate(goal, pool, total, cpm), cpm)
+        difference = max(abs(expected[0] - simulated[0]), abs(expected[1] - simulated[1]))
+        report['worst'] = max(report['worst'], difference)
+        if difference == 0:
+            report['exact'] += 1
+        elif difference == 1:
+            report['off_by_one'] += 1
+        else:
+            report['mismatches'].append({'goal': goal, 'pool': pool, 'total': total, 'shuffled': shuffled, 'doors': doors, 'table': expected, 'simulated': simulated})
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(add_help=True)
+    parser.add_argument('command', choices=['build', 'check'], help='Build the TFH table, or check it against the simulation')
+    parser.add_argument('-i', help='Path to the points weights file to use for rolling game settings')
+    parser.add_argument('-t', help='Path of the TFH table')
+    parser.add_argument('--samples', help='Table entries to simulate when checking', type=int, default=200)
+    parser.add_argument('--shuffle', help='Check against the reference shuffle simulation instead of the vectorized one', action='store_true')
+    parser.add_argument('--seed', help='Seed for the sampled entries and the simulation', type=int)
+    args = parser.parse_args()
+
+    weight_file = args.i if args.i else "MMMM_weights.json"
+    table_file = args.t if args.t else MMMM.TFH_TABLE_FILE
+    with open(weight_file, "r", encoding='utf-8') as f:
+        input_weights = json.load(f)
+
+    if args.command == 'build':
+        table, values = build_tfh_table(input_weights)
+        save_tfh_table(table_file, table, values)
+        print(f'Wrote {len(values) // 2} TFH entries to {table_file}')
+        return
+
+    table = MMMM.load_tfh_table(table_file, MMMM.tfh_table_source(input_weights))
+    if not table:
+        sys.exit(f'{table_file} is missing or was built from other weights, run the build command first.')
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+    report = check_tfh_table(input_weights, table, args.samples, args.shuffle)
+    print(json.dumps(report, indent=4))
+    if report['mismatches']:
+        sys.exit('TFH table disagrees with the simulation by more than one point.')
+
+if __name__ == '__main__':
+    main()